@@ -12,8 +12,11 @@ Repositório: https://github.com/cjhutto/vaderSentiment
 
 import re
 import math
+import heapq
+import pickle
 import unicodedata
-from itertools import product
+from itertools import repeat
+from threading import Lock
 import os
 
 PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
@@ -37,20 +40,140 @@ PUNC_LIST = [
     "!?!", "?!?!", "!?!?"
 ]
 
-# Negations (Portuguese)
-NEGATE = [t.strip() for t in open(
-    os.path.join(PACKAGE_DIRECTORY, 'lexicons', 'negate.txt')
-)]
+# Characters that can start or end an entry of PUNC_LIST
+PUNC_CHARS = frozenset(''.join(PUNC_LIST))
 
-# Booster/dampener 'intensifiers' or 'degree adverbs' (Portuguese)
-boosters = []
-for boost in open(os.path.join(PACKAGE_DIRECTORY, 'lexicons', 'booster.txt')):
-    parts = boost.strip().split(' ')
-    boosters.append([' '.join(parts[:-1]), parts[-1]])
+LEXICON_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, 'lexicons')
+NEGATE_FILE = os.path.join(LEXICON_DIRECTORY, 'negate.txt')
+BOOSTER_FILE = os.path.join(LEXICON_DIRECTORY, 'booster.txt')
+LEXICON_FILE = os.path.join(LEXICON_DIRECTORY, 'vader_lexicon_ptbr.txt')
+EMOJI_LEXICON_FILE = os.path.join(LEXICON_DIRECTORY, 'emojis.txt')
 
-BOOSTER_DICT = {}
-for t, v in boosters: 
-    BOOSTER_DICT[t] = B_INCR if v == 'INCR' else B_DECR
+# Bump when the parsed form of a lexicon changes, to invalidate the pickles
+LEXICON_CACHE_VERSION = 1
+
+
+def parse_negate(text):
+    """
+    Negations (Portuguese), one per line
+    """
+    return [t.strip() for t in text.splitlines(True)]
+
+
+def parse_boosters(text):
+    """
+    Booster/dampener 'intensifiers' or 'degree adverbs' (Portuguese),
+    one per line followed by INCR or DECR
+    """
+    booster_dict = {}
+    for boost in text.splitlines():
+        parts = boost.strip().split(' ')
+        booster_dict[' '.join(parts[:-1])] = B_INCR if parts[-1] == 'INCR' else B_DECR
+    return booster_dict
+
+
+def parse_lexicon(text):
+    """
+    Convert lexicon file to a dictionary
+    """
+    lex_dict = {}
+    for line in text.split('\n'):
+        if len(line) < 1:
+            continue
+        (word, measure) = line.strip().split('\t')[0:2]
+        lex_dict[word] = float(measure)
+    return lex_dict
+
+
+def parse_emojis(text):
+    """
+    Convert emoji lexicon file to a dictionary
+    """
+    emoji_dict = {}
+    for line in text.split('\n'):
+        if len(line) < 1:
+            continue
+        (emoji, description) = line.strip().split('\t')[0:2]
+        emoji_dict[emoji] = description
+    return emoji_dict
+
+
+_lexicons = {}
+_lexicons_lock = Lock()
+
+
+def _pickle_path(path, parser):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '__pycache__', f'{name}.{parser.__name__}.pickle')
+
+
+def _load_pickle(path, fingerprint):
+    try:
+        with open(path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['version'] == LEXICON_CACHE_VERSION and cached['fingerprint'] == fingerprint:
+            return cached['data']
+    except Exception:
+        pass
+    return None
+
+
+def _save_pickle(path, fingerprint, data):
+    # Best effort: a read-only install just parses the text every run
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': LEXICON_CACHE_VERSION, 'fingerprint': fingerprint,
+                         'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def load_lexicon(path, parser):
+    """
+    Parse a lexicon file with parser, once per process. The parsed form is
+    shared by every caller (do not mutate it) and pickled under
+    __pycache__, keyed by the file's mtime and size, so later processes
+    skip the text parsing.
+    """
+    key = (os.path.abspath(path), parser)
+    lexicon = _lexicons.get(key)
+    if lexicon is not None:
+        return lexicon
+    with _lexicons_lock:
+        if key in _lexicons:
+            return _lexicons[key]
+        stat = os.stat(path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        cache_path = _pickle_path(key[0], parser)
+        lexicon = _load_pickle(cache_path, fingerprint)
+        if lexicon is None:
+            with open(path, encoding='utf-8') as f:
+                lexicon = parser(f.read())
+            _save_pickle(cache_path, fingerprint, lexicon)
+        _lexicons[key] = lexicon
+        return lexicon
+
+
+def negate_words():
+    return load_lexicon(NEGATE_FILE, parse_negate)
+
+
+def booster_dict():
+    return load_lexicon(BOOSTER_FILE, parse_boosters)
+
+
+def __getattr__(name):
+    """
+    NEGATE and BOOSTER_DICT are loaded on first access, not on import
+    """
+    if name == 'NEGATE':
+        return negate_words()
+    if name == 'BOOSTER_DICT':
+        return booster_dict()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # Check for special case idioms containing lexicon words
@@ -64,7 +187,7 @@ def negated(input_words, include_nt=True):
     """
     input_words = [str(w).lower() for w in input_words]
     neg_words = []
-    neg_words.extend(NEGATE)
+    neg_words.extend(negate_words())
     for word in neg_words:
         if word in input_words:
             return True
@@ -113,8 +236,9 @@ def scalar_inc_dec(word, valence, is_cap_diff):
     """
     scalar = 0.0
     word_lower = word.lower()
-    if word_lower in BOOSTER_DICT:
-        scalar = BOOSTER_DICT[word_lower]
+    boosters = booster_dict()
+    if word_lower in boosters:
+        scalar = boosters[word_lower]
         if valence < 0:
             scalar *= -1
         
@@ -127,60 +251,56 @@ def scalar_inc_dec(word, valence, is_cap_diff):
     return scalar
 
 
+def strip_punc(word, words_only):
+    """
+    Remove one leading or trailing PUNC_LIST entry from word when what is
+    left is one of words_only. Same result as looking word up in the
+    punctuation product tables of the original VADER tokenizer (kept in
+    tests/test_leia_tokenizer.py): a trailing entry takes precedence, and
+    among leading entries the last one in PUNC_LIST wins.
+    """
+    if word[-1] in PUNC_CHARS:
+        for punc in PUNC_LIST:
+            if word.endswith(punc) and word[:-len(punc)] in words_only:
+                return word[:-len(punc)]
+    if word[0] in PUNC_CHARS:
+        for punc in reversed(PUNC_LIST):
+            if word.startswith(punc) and word[len(punc):] in words_only:
+                return word[len(punc):]
+    return word
+
+
 class SentiText(object):
     """
     Identify sentiment-relevant string-level properties of input text.
     """
 
-    def __init__(self, text):
+    def __init__(self, text, words=None):
+        """
+        words, if given, must be text.split(), already computed by the caller
+        """
         if not isinstance(text, str):
             text = str(text).encode('utf-8')
         self.text = text
-        self.words_and_emoticons = self._words_and_emoticons()
+        self.words_and_emoticons = self._words_and_emoticons(words)
         
         # Doesn't separate words from adjacent
         # punctuation (keeps emoticons & contractions)
         self.is_cap_diff = allcap_differential(self.words_and_emoticons)
 
 
-    def _words_plus_punc(self):
-        """
-        Returns mapping of form:
-        {
-            'cat,': 'cat',
-            ',cat': 'cat',
-        }
-        """
-        no_punc_text = REGEX_REMOVE_PUNCTUATION.sub('', self.text)
-        
-        # Removes punctuation (but loses emoticons & contractions)
-        words_only = no_punc_text.split()
-        
-        # Remove singletons
-        words_only = set(w for w in words_only if len(w) > 1)
-        
-        # The product gives ('cat', ',') and (',', 'cat')
-        punc_before = {''.join(p): p[1] for p in product(PUNC_LIST, words_only)}
-        punc_after = {''.join(p): p[0] for p in product(words_only, PUNC_LIST)}
-        words_punc_dict = punc_before
-        words_punc_dict.update(punc_after)
-
-        return words_punc_dict
-
-
-    def _words_and_emoticons(self):
+    def _words_and_emoticons(self, words=None):
         """
         Removes leading and trailing puncutation
         Leaves contractions and most emoticons
             Does not preserve punc-plus-letter emoticons (e.g. :D)
+        Single pass over the tokens, without the product tables of the
+        original implementation (see tests/test_leia_tokenizer.py)
         """
-        wes = self.text.split()
-        words_punc_dict = self._words_plus_punc()
-        wes = [we for we in wes if len(we) > 1]
-        for i, we in enumerate(wes):
-            if we in words_punc_dict:
-                wes[i] = words_punc_dict[we]
-        return wes
+        if words is None:
+            words = self.text.split()
+        words_only = set(w for w in map(REGEX_REMOVE_PUNCTUATION.sub, repeat(''), words) if len(w) > 1)
+        return [strip_punc(we, words_only) for we in words if len(we) > 1]
 
 
 class SentimentIntensityAnalyzer(object):
@@ -188,25 +308,11 @@ class SentimentIntensityAnalyzer(object):
     Give a sentiment intensity score to sentences.
     """
 
-    def __init__(
-            self,
-            lexicon_file=os.path.join(
-                PACKAGE_DIRECTORY,
-                'lexicons',
-                'vader_lexicon_ptbr.txt'
-            ),
-            emoji_lexicon=os.path.join(
-                PACKAGE_DIRECTORY,
-                'lexicons',
-                'emoji_utf8_lexicon_ptbr.txt'
-            )
-    ):
-        with open(lexicon_file, encoding='utf-8') as f:
-            self.lexicon_full_filepath = f.read()
+    def __init__(self, lexicon_file=LEXICON_FILE, emoji_lexicon=EMOJI_LEXICON_FILE):
+        self.lexicon_file = lexicon_file
+        self.emoji_lexicon = emoji_lexicon
+        # Shared between analyzers of the same files (see load_lexicon)
         self.lexicon = self.make_lex_dict()
-
-        with open(emoji_lexicon, encoding='utf-8') as f:
-            self.emoji_full_filepath = f.read()
         self.emojis = self.make_emoji_dict()
 
 
@@ -214,26 +320,14 @@ class SentimentIntensityAnalyzer(object):
         """
         Convert lexicon file to a dictionary
         """
-        lex_dict = {}
-        for line in self.lexicon_full_filepath.split('\n'):
-            if len(line) < 1:
-                continue
-            (word, measure) = line.strip().split('\t')[0:2]
-            lex_dict[word] = float(measure)
-        return lex_dict
+        return load_lexicon(self.lexicon_file, parse_lexicon)
 
 
     def make_emoji_dict(self):
         """
         Convert emoji lexicon file to a dictionary
         """
-        emoji_dict = {}
-        for line in self.emoji_full_filepath.split('\n'):
-            if len(line) < 1:
-                continue
-            (emoji, description) = line.strip().split('\t')[0:2]
-            emoji_dict[emoji] = description
-        return emoji_dict
+        return load_lexicon(self.emoji_lexicon, parse_emojis)
 
 
     def polarity_scores(self, text):
@@ -242,7 +336,63 @@ class SentimentIntensityAnalyzer(object):
         Positive values are positive valence, negative value are negative
         valence.
         """
+        text = self._prepare_text(text)
+        sentiments = self._sentiments(SentiText(text))
+        return self._score_valences([sentiments], [text])[0]
+
+
+    def polarity_scores_batch(self, texts):
+        """
+        Return the polarity_scores of every text in texts, in order.
+        Each text is lowercased once and its tokens are walked by position;
+        the compound/pos/neg/neu normalisation is then computed column-wise
+        for the whole batch. The output matches polarity_scores.
+        """
+        texts = [self._prepare_text(text) for text in texts]
+        sentiments = [self._sentiments(SentiText(text)) for text in texts]
+        return self._score_valences(sentiments, texts)
+
+
+    def polarity_scores_words(self, words):
+        """
+        polarity_scores of a sentence given as its whitespace-separated
+        words (sentence.split()), for callers that have already split it
+        """
+        return self.polarity_scores_words_batch([words])[0]
+
+
+    def polarity_scores_words_batch(self, words_batch):
+        """
+        polarity_scores_words of every word list in words_batch, in order
+        """
+        texts = []
+        sentitexts = []
+        for words in words_batch:
+            words = self._prepare_words(words)
+            text = " ".join(words)
+            texts.append(text)
+            sentitexts.append(SentiText(text, words))
+        return self._score_valences([self._sentiments(sentitext) for sentitext in sentitexts], texts)
+
+
+    def _prepare_words(self, words):
+        """
+        _prepare_text for a text already split into words
+        """
+        prepared = []
+        for word in words:
+            for token in unicodedata.normalize('NFKD', word).encode('ASCII', 'ignore').decode('ASCII').split():
+                if token in self.emojis:
+                    prepared.extend(self.emojis[token].split())
+                else:
+                    prepared.append(token)
+        return prepared
+
 
+    def _prepare_text(self, text):
+        """
+        Remove accents and replace emojis by their textual descriptions
+        """
         # Remove acentos
         text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('ASCII')
 
@@ -256,32 +406,40 @@ class SentimentIntensityAnalyzer(object):
                 text_no_emoji_lst.append(description)
             else:
                 text_no_emoji_lst.append(token)
-        text = " ".join(x for x in text_no_emoji_lst)
+        return " ".join(x for x in text_no_emoji_lst)
 
-        sentitext = SentiText(text)
 
+    def _sentiments(self, sentitext):
+        """
+        Valence of every token of sentitext, lowercasing each token once.
+        As in the original VADER loop, a repeated token is scored in the
+        context of its first occurrence.
+        """
         sentiments = []
         words_and_emoticons = sentitext.words_and_emoticons
-        for item in words_and_emoticons:
+        words_lower = [w.lower() for w in words_and_emoticons]
+        first_index = {}
+        for i, item in enumerate(words_and_emoticons):
+            first_index.setdefault(item, i)
+        boosters = booster_dict()
+        for item, item_lower in zip(words_and_emoticons, words_lower):
             valence = 0
-            i = words_and_emoticons.index(item)
             # check for vader_lexicon words that may be used as modifiers or negations
-            if item.lower() in BOOSTER_DICT:
+            if item_lower in boosters:
                 sentiments.append(valence)
                 continue
 
-            sentiments = self.sentiment_valence(valence, sentitext, item, i, sentiments)
-
-        sentiments = self._but_check(words_and_emoticons, sentiments)
-        valence_dict = self.score_valence(sentiments, text)
+            sentiments = self.sentiment_valence(valence, sentitext, item, first_index[item], sentiments, words_lower)
 
-        return valence_dict
+        return self._but_check(words_and_emoticons, sentiments, words_lower)
 
 
-    def sentiment_valence(self, valence, sentitext, item, i, sentiments):
+    def sentiment_valence(self, valence, sentitext, item, i, sentiments, words_lower=None):
         is_cap_diff = sentitext.is_cap_diff
         words_and_emoticons = sentitext.words_and_emoticons
-        item_lowercase = item.lower()
+        if words_lower is None:
+            words_lower = [str(w).lower() for w in words_and_emoticons]
+        item_lowercase = words_lower[i]
         if item_lowercase in self.lexicon:
 
             # Get the sentiment valence
@@ -298,16 +456,16 @@ class SentimentIntensityAnalyzer(object):
                 # Dampen the scalar modifier of preceding words and emoticons
                 # (excluding the ones that immediately preceed the item) based
                 # on their distance from the current item.
-                if i > start_i and words_and_emoticons[i - (start_i + 1)].lower() not in self.lexicon:
+                if i > start_i and words_lower[i - (start_i + 1)] not in self.lexicon:
                     s = scalar_inc_dec(words_and_emoticons[i - (start_i + 1)], valence, is_cap_diff)
                     if start_i == 1 and s != 0:
                         s = s * 0.95
                     if start_i == 2 and s != 0:
                         s = s * 0.9
                     valence = valence + s
-                    valence = self._negation_check(valence, words_and_emoticons, start_i, i)
+                    valence = self._negation_check(valence, words_and_emoticons, start_i, i, words_lower)
                     if start_i == 2:
-                        valence = self._special_idioms_check(valence, words_and_emoticons, i)
+                        valence = self._special_idioms_check(valence, words_and_emoticons, i, words_lower)
 
             # valence = self._least_check(valence, words_and_emoticons, i)
         sentiments.append(valence)
@@ -329,27 +487,57 @@ class SentimentIntensityAnalyzer(object):
 
 
     @staticmethod
-    def _but_check(words_and_emoticons, sentiments):
+    def _but_check(words_and_emoticons, sentiments, words_lower=None):
         # Check for modification in sentiment due to contrastive conjunction 'but'
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
+        if words_lower is None:
+            words_lower = [str(w).lower() for w in words_and_emoticons]
 
+        # Only the first conjunction of the list is ever checked (the loop
+        # returns on its first iteration), as in the original implementation
         for mas in ['mas', 'entretanto', 'todavia', 'porem', 'porém']:
-            if mas in words_and_emoticons_lower:
-                bi = words_and_emoticons_lower.index(mas)
-                for sentiment in sentiments:
-                    si = sentiments.index(sentiment)
-                    if si < bi:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 0.5)
-                    elif si > bi:
-                        sentiments.pop(si)
-                        sentiments.insert(si, sentiment * 1.5)
+            if mas in words_lower:
+                SentimentIntensityAnalyzer._but_scale(sentiments, words_lower.index(mas))
             return sentiments
 
 
     @staticmethod
-    def _special_idioms_check(valence, words_and_emoticons, i):
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
+    def _but_scale(sentiments, bi):
+        """
+        Same result as the original in-place loop
+
+            for sentiment in sentiments:
+                si = sentiments.index(sentiment)
+                scale sentiments[si] by 0.5 (si < bi) or 1.5 (si > bi)
+
+        in O(n log n): every sentiment is scaled at the first position that
+        currently holds its value, found through a heap of positions per value.
+        """
+        positions = {}
+        for j, value in enumerate(sentiments):
+            positions.setdefault(value, []).append(j)
+        for k in range(len(sentiments)):
+            value = sentiments[k]
+            heap = positions[value]
+            while sentiments[heap[0]] != value:
+                heapq.heappop(heap)
+            si = heap[0]
+            if si < bi:
+                scaled = value * 0.5
+            elif si > bi:
+                scaled = value * 1.5
+            else:
+                continue
+            if scaled != value:
+                heapq.heappop(heap)
+                sentiments[si] = scaled
+                heapq.heappush(positions.setdefault(scaled, []), si)
+
+
+    @staticmethod
+    def _special_idioms_check(valence, words_and_emoticons, i, words_lower=None):
+        words_and_emoticons_lower = words_lower
+        if words_and_emoticons_lower is None:
+            words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
         onezero = "{0} {1}".format(
             words_and_emoticons_lower[i - 1], 
             words_and_emoticons_lower[i]
@@ -403,16 +591,19 @@ class SentimentIntensityAnalyzer(object):
 
         # Check for booster/dampener bi-grams such as 'sort of' or 'kind of'
         n_grams = [threetwoone, threetwo, twoone]
+        boosters = booster_dict()
         for n_gram in n_grams:
-            if n_gram in BOOSTER_DICT:
-                valence = valence + BOOSTER_DICT[n_gram]
+            if n_gram in boosters:
+                valence = valence + boosters[n_gram]
 
         return valence
 
 
     @staticmethod
-    def _negation_check(valence, words_and_emoticons, start_i, i):
-        words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
+    def _negation_check(valence, words_and_emoticons, start_i, i, words_lower=None):
+        words_and_emoticons_lower = words_lower
+        if words_and_emoticons_lower is None:
+            words_and_emoticons_lower = [str(w).lower() for w in words_and_emoticons]
         if start_i == 0:
             if negated([words_and_emoticons_lower[i - (start_i + 1)]]):  # 1 word preceding lexicon word (w/o stopwords)
                 valence = valence * N_SCALAR
@@ -494,46 +685,58 @@ class SentimentIntensityAnalyzer(object):
 
 
     def score_valence(self, sentiments, text):
-        if sentiments:
-            sum_s = float(sum(sentiments))
-            # Compute and add emphasis from punctuation in text
-            punct_emph_amplifier = self._punctuation_emphasis(text)
+        return self._score_valences([sentiments], [text])[0]
+
+
+    def _score_valences(self, sentiments_batch, texts):
+        """
+        Normalise the valences of a batch of sentences, one column (sum,
+        punctuation emphasis, positive/negative/neutral sums) at a time
+        """
+        n = len(texts)
+        sums = [float(sum(sentiments)) for sentiments in sentiments_batch]
+        # Compute and add emphasis from punctuation in text
+        amplifiers = [self._punctuation_emphasis(text) for text in texts]
+        # Discriminate between positive, negative and neutral sentiment scores
+        sifted = [self._sift_sentiment_scores(sentiments) for sentiments in sentiments_batch]
+
+        compounds = [0.0] * n
+        pos = [0.0] * n
+        neg = [0.0] * n
+        neu = [0.0] * n
+        for k in range(n):
+            if not sentiments_batch[k]:
+                continue
+            sum_s, amplifier = sums[k], amplifiers[k]
             if sum_s > 0:
-                sum_s += punct_emph_amplifier
+                sum_s += amplifier
             elif sum_s < 0:
-                sum_s -= punct_emph_amplifier
-
-            compound = normalize(sum_s)
-            # Discriminate between positive, negative and neutral sentiment scores
-            pos_sum, neg_sum, neu_count = self._sift_sentiment_scores(sentiments)
+                sum_s -= amplifier
+            compounds[k] = normalize(sum_s)
 
+            pos_sum, neg_sum, neu_count = sifted[k]
             if pos_sum > math.fabs(neg_sum):
-                pos_sum += punct_emph_amplifier
+                pos_sum += amplifier
             elif pos_sum < math.fabs(neg_sum):
-                neg_sum -= punct_emph_amplifier
+                neg_sum -= amplifier
 
             total = pos_sum + math.fabs(neg_sum) + neu_count
-            pos = math.fabs(pos_sum / total)
-            neg = math.fabs(neg_sum / total)
-            neu = math.fabs(neu_count / total)
-
-        else:
-            compound = 0.0
-            pos = 0.0
-            neg = 0.0
-            neu = 0.0
-
-        sentiment_dict = {
-            'neg': round(neg, 3),
-            'neu': round(neu, 3),
-            'pos': round(pos, 3),
-            'compound': round(compound, 4)
-        }
+            pos[k] = math.fabs(pos_sum / total)
+            neg[k] = math.fabs(neg_sum / total)
+            neu[k] = math.fabs(neu_count / total)
 
-        return sentiment_dict
+        return [
+            {
+                'neg': round(neg[k], 3),
+                'neu': round(neu[k], 3),
+                'pos': round(pos[k], 3),
+                'compound': round(compounds[k], 4)
+            }
+            for k in range(n)
+        ]
 
 
 if __name__ == '__main__':
     pass
 
-    # TODO: tests and examples (Portuguese)
+    # TODO: examples (Portuguese)
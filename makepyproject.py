@@ -35,12 +35,15 @@ def main():
 
     dependencies = [
         "spacy",
-        "jjcli",
-        "matplotlib"                 
+        "jjcli"
     ]
 
+    [project.optional-dependencies]
+    plot = ["matplotlib"]
+
     [project.scripts]
     {{name}} = "{{name}}:main"
+    {{name}}_benchmark = "{{name}}.benchmark:main"
 
     ''')
 
@@ -4,7 +4,7 @@
     
     DESCRIPTION
         This program analyzes the sentiment of a given text file or user input.
-        It uses the spaCy library to process the text and the Matcher class to match multiword expressions.
+        It uses the spaCy library to process the text and the PhraseMatcher class to match multiword expressions.
         The program uses several datasets to analyze the sentiment of the text, such as BoosterWordList, EmoticonLookupTable,
         EmotionLookupTable, IronyTerms, NegatingWordList, QuestionWords, SlangLookupTable and Sentilex.
         The program can analyze the sentiment of a book, splitting it into chapters and analyzing each chapter.
@@ -13,12 +13,70 @@
     OPTIONS
         [no options]    :   User input mode.
         -f <file_path>  :   Path to the book file to be analyzed.
+        -d <corpus>     :   Corpus mode: every .txt file of a directory (recursively), of a
+                            glob pattern or of a manifest (one path per line). Files are
+                            analysed whole, largest first, across --workers processes;
+                            writes <output dir>/corpus.jsonl (journal: an interrupted run
+                            resumes where it stopped) and corpus_report.json (default: corpus).
         -t              :   Test mode.
+        -m <model>      :   spaCy model: sm, md, lg (default) or a full model name.
+        --full-pipeline :   Keep every pipeline component (parser and NER included).
+        -o <dir>        :   Output directory for the chapter reports (default: chapters).
+        --output-format <text|jsonl|csv>
+                        :   Chapter reports as text (default) or one JSONL/CSV record per
+                            sentence (sentences.*) plus a per-chapter summary (chapters.*).
+        --workers <n>   :   Analyze the book's chapters in n worker processes (with --serve:
+                            n pre-forked workers that share the model loaded in the parent).
+        --build-snapshot:   Rebuild the precompiled lexicon snapshot (data/lexicons.snapshot).
+        --cache <n>     :   Cache the results of the last n distinct sentences (LRU).
+        --reparse       :   Re-run the pipeline on the lemmatised text (old two-pass mode).
+        --engine <spacy|fast>
+                        :   Analysis engine: the spaCy model (default) or the fast engine,
+                            with no model (regex tokenizer and data/LemmaTable.txt).
+        --build-lemma-table
+                        :   Build data/LemmaTable.txt with the spaCy model, from the lexicons
+                            and the model vocabulary (plus the book given with -f, if any).
+        --agreement <file>
+                        :   Share of the book's sentences that the fast engine scores like spaCy.
+        --no-plot       :   Do not draw the charts (chapter_scores and sentiment_arc, PNG and
+                            SVG, in the output directory); matplotlib is not even imported.
+        --score-only    :   Compute only the score and word count, without collecting the
+                            evidences (same scores, much less allocation).
+        --incremental   :   Keep the results in <output dir>/results.sqlite and, on later runs,
+                            only analyse the sentences that changed (chapter files that did
+                            not change are not rewritten).
+        --ensemble      :   Score with both Sentilex and LeIA in one pass; the score is the
+                            mean of the two (Sentilex normalised to [-1, 1]), and both
+                            partial scores are reported.
+        --profile <path>:   Time each analysis stage and count tokens, matches and lexicon
+                            hits, per chapter and per run; writes <path>.json and a
+                            cProfile dump <path>.pstats.
+        --serve         :   HTTP/JSON scoring service (POST /analyze {"text"|"texts"}).
+        --socket <path> :   Serve on a Unix socket with pre-forked workers (see --workers).
+        --host <host>   :   Address to serve on (default: 127.0.0.1).
+        --port <port>   :   Port to serve on (default: 8080).
+        --stream        :   Read lines from stdin (plain text or JSON {"text": ..., "id": ...})
+                            and write one JSON result per line to stdout, in order, in
+                            batches of up to --max-batch lines; messages go to stderr.
+        --max-batch <n> :   Maximum number of sentences per micro-batch (default: 64;
+                            with --stream: 256).
+        --max-wait <ms> :   Maximum wait for a micro-batch to fill (default: 5 ms).
     
     EXAMPLES
         sentiment-analysis
         sentiment-analysis -f HP.txt
         sentiment-analysis -t
+        sentiment-analysis -m sm -f HP.txt
+        sentiment-analysis --serve --port 8080
+        sentiment-analysis --serve --workers 8 --socket /tmp/sentiment.sock
+        zcat logs.jsonl.gz | sentiment-analysis --stream --score-only > scores.jsonl
+        sentiment-analysis --engine fast -f HP.txt
+        sentiment-analysis --agreement HP.txt
+        sentiment-analysis --ensemble -f HP.txt --output-format jsonl
+        sentiment-analysis --incremental -f HP.txt
+        sentiment-analysis -f HP.txt --no-plot
+        sentiment-analysis -d books/ --workers 8 -o books_report
+        sentiment-analysis -d 'books/**/*.txt' --workers 8
         
     AUTHOR
         Francisca Barros, Rafael Correia, Robert Szabo
@@ -29,53 +87,270 @@
         
     DEPENDENCIES
         spacy
-        matplotlib
-        jjcli    
+        jjcli
+        matplotlib (optional, for the charts)
 """
 
 import spacy
-from spacy.matcher import Matcher
+from spacy.matcher import PhraseMatcher
+from spacy.tokens import Doc
+from spacy.util import filter_spans
 from jjcli import *
-import matplotlib.pyplot as plt
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from contextlib import nullcontext, redirect_stdout
+from itertools import groupby, islice
+from multiprocessing import Pool
+from operator import itemgetter
+from queue import Empty, Queue
+from threading import Lock, Thread
+import cProfile
+import importlib.util
+import csv
+import glob
+import hashlib
+import json
 import os
+import pickle
+import pstats
+import re
+import sqlite3
 import subprocess
+import sys
+import time
+import unicodedata
 
-def init():
+# nº de frases por lote enviado ao nlp.pipe
+DEFAULT_BATCH_SIZE = 256
+# nº de lotes lidos de cada vez para ordenar por comprimento
+BUCKETS_PER_WINDOW = 16
+
+# modelos disponíveis (também podem ser indicados pelo nome completo)
+MODELS = {
+    'sm': 'pt_core_news_sm',
+    'md': 'pt_core_news_md',
+    'lg': 'pt_core_news_lg',
+}
+DEFAULT_MODEL = 'lg'
+# a análise só usa text, lemma_, pos_ e is_punct: o parser e o NER nunca são usados
+EXCLUDED_COMPONENTS = ['parser', 'ner', 'senter']
+# motores de análise: o modelo do spaCy ou o motor rápido, sem modelo
+ENGINES = ('spacy', 'fast')
+DEFAULT_ENGINE = 'spacy'
+analysis_engine = DEFAULT_ENGINE
+collect_evidence = True
+
+# memória residente do processo (MB)
+def memory_usage():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+# argumentos da última chamada a init(), reutilizados pelos workers
+last_init_args = (DEFAULT_MODEL, EXCLUDED_COMPONENTS, 0, False, DEFAULT_ENGINE, False, True)
+
+# Cache LRU opcional dos resultados por frase, partilhada pelos modos de
+# análise (frase a frase, lotes, livro). A chave é a frase em minúsculas (a
+# única normalização que não altera o resultado) e o modo de análise; os
+# resultados guardados são só de leitura, porque são partilhados por todos
+# os pedidos da mesma frase.
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+class FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached sentiment results are read-only")
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(avaliacao):
+    if 'evidencias' not in avaliacao:
+        return FrozenDict(avaliacao)
+    evidencias = avaliacao['evidencias']
+    evidencias = FrozenDict((key, tuple(value)) for key, value in evidencias.items())
+    return FrozenDict(avaliacao, evidencias=evidencias)
+
+class SentenceCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            avaliacao = self.data.get(key)
+            if avaliacao is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+            return avaliacao
+
+    def put(self, key, avaliacao):
+        avaliacao = freeze(avaliacao)
+        with self.lock:
+            self.data[key] = avaliacao
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+        return avaliacao
+
+    # repetições, na mesma janela, de uma frase já procurada
+    def add_hits(self, count):
+        with self.lock:
+            self.hits += count
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.data))
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+sentence_cache = None
+
+# Instrumentação opcional: tempo por etapa da análise de cada frase (nlp,
+# reparse, match, retokenize, lexicon, cues) e contadores (frases, tokens,
+# expressões encontradas, entradas dos léxicos), agregados por capítulo e
+# por execução. Desligada, cada etapa custa só uma chamada a stage(), que
+# devolve um context manager vazio.
+class Stage:
+    __slots__ = ('totals', 'name', 'start')
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.totals[self.name] += time.perf_counter() - self.start
+
+class Profiler:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.chapters = []
+        self.chapter = None
+
+    def stage(self, name):
+        return Stage(self.totals, f'{name}_seconds')
+
+    def count(self, name, value):
+        self.totals[name] += value
+
+    # totais acumulados desde a última chamada (enviados pelos workers)
+    def take(self):
+        totals = dict(self.totals)
+        self.totals.clear()
+        return totals
+
+    def merge(self, totals):
+        for name, value in totals.items():
+            self.totals[name] += value
+
+    def start_chapter(self, number):
+        self.chapter = (number.strip(), dict(self.totals))
+
+    def end_chapter(self):
+        number, start = self.chapter
+        totals = {name: value - start.get(name, 0) for name, value in self.totals.items()}
+        self.chapters.append({'chapter': number, **totals})
+
+    def report(self):
+        return {'run': dict(self.totals), 'chapters': self.chapters}
+
+NULL_STAGE = nullcontext()
+profiler = None
+
+def stage(name):
+    return NULL_STAGE if profiler is None else profiler.stage(name)
+
+def count(name, value):
+    if profiler is not None:
+        profiler.count(name, value)
+
+def enable_profiling():
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+    return profiler
+
+def init(model=DEFAULT_MODEL, exclude=EXCLUDED_COMPONENTS, cache_size=0, profile=False, engine=DEFAULT_ENGINE, ensemble=False, evidence=True):
+    global last_init_args
+    last_init_args = (model, exclude, cache_size, profile, engine, ensemble, evidence)
+    # sem evidências só se calculam a pontuação e o número de palavras
+    global collect_evidence
+    collect_evidence = evidence
+    global sentence_cache
+    sentence_cache = SentenceCache(cache_size) if cache_size > 0 else None
+    if profile:
+        enable_profiling()
+    global leia, leia_analyzer
+    if ensemble:
+        leia = load_leia()
+        leia_analyzer = leia.SentimentIntensityAnalyzer()
+    else:
+        leia_analyzer = None
+    global analysis_engine
+    analysis_engine = engine
+    if engine == 'fast':
+        # o motor rápido não usa o modelo (a não ser para gerar a tabela, se faltar)
+        load_datasets()
+        init_fast(model, exclude)
+        print(f"Fast engine ready ({len(lemma_table)} lemmas; RSS: {memory_usage():.1f} MB)")
+        return
     # Load the language model   
     global nlp
+    model = MODELS.get(model, model)
+    start = time.perf_counter()
     try:
-        nlp = spacy.load('pt_core_news_lg')
+        nlp = spacy.load(model, exclude=exclude)
     except OSError:
-        print("Model not found. In order to work, the model 'pt_core_news_lg' (568.2 MB) must be downloaded.")
+        print(f"Model not found. In order to work, the model '{model}' must be downloaded.")
         print("Do you want to download it now? (y/n)")
         if input().lower() == 'y':
-            subprocess.run(['python', '-m', 'spacy', 'download', 'pt_core_news_lg'])
-            nlp = spacy.load('pt_core_news_lg')
+            subprocess.run(['python', '-m', 'spacy', 'download', model])
+            nlp = spacy.load(model, exclude=exclude)
         else:
             print("Exiting program.")
             exit(1)
-    # Initialize the Matcher
+    print(f"Model {model} loaded in {time.perf_counter() - start:.2f}s "
+          f"(pipeline: {', '.join(nlp.pipe_names)}; RSS: {memory_usage():.1f} MB)")
+    load_datasets()
+    # Initialize the PhraseMatcher
     global matcher
-    matcher = Matcher(nlp.vocab)
-    # Carregar os datasets
+    matcher = PhraseMatcher(nlp.vocab, attr="NORM")
+    # todas as expressões (IDIOM) são registadas de uma vez
+    matcher.add("IDIOM", idiom_docs(nlp.vocab, expressions))
+
+# Carregar os datasets
+def load_datasets():
     print("Loading datasets...")
-    global booster_words
-    booster_words = load_data('data/BoosterWordList.txt')
-    global emoticons
-    emoticons = load_data('data/EmoticonLookupTable.txt')
-    global expressions, emotions
-    expressions, emotions = load_data_sentilex('data/palavras.txt')
-    global emotions2
-    emotions2 = load_data('data/EmotionLookupTable.txt')
-    emotions.update(emotions2)
-    global irony_terms
-    irony_terms = set(open('data/IronyTerms.txt', 'r', encoding='utf-8').read().splitlines())
-    global negating_words
-    negating_words = set(open('data/NegatingWordList.txt', 'r', encoding='utf-8').read().splitlines())
-    global question_words
-    question_words = set(open('data/QuestionWords.txt', 'r', encoding='utf-8').read().splitlines())
-    global slang_lookup_table
-    slang_lookup_table = load_data('data/SlangLookupTable.txt',0)
+    lexicons = load_lexicons()
+    global lexicon_index, expressions
+    global irony_terms, negating_words, question_words, slang_lookup_table
+    lexicon_index = lexicons['lexicon_index']
+    print(f"Lexicon index: {len(lexicon_index)} terms, {lexicon_index.footprint() / 2**10:.0f} KB")
+    expressions = lexicons['expressions']
+    irony_terms = lexicons['irony_terms']
+    negating_words = lexicons['negating_words']
+    question_words = lexicons['question_words']
+    slang_lookup_table = lexicons['slang_lookup_table']
+    global cue_regex, cue_classes
+    cue_regex, cue_classes = compile_cues({
+        'ironia': irony_terms,
+        'negadores': negating_words,
+        'perguntas': question_words,
+    })
 
 # Carregar os dados dos arquivos
 def load_data(file_path,flag=1):
@@ -87,6 +362,10 @@ def load_data(file_path,flag=1):
             else: data[word] = value
     return data
 
+def load_set(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return set(file.read().splitlines())
+
 #avinhado.PoS=Adj;TG=HUM:N0;POL:N0=-1;ANOT=MAN
 #bajular.PoS=V;TG=HUM:N0:N1;POL:N0=-1;POL:N1=0;ANOT=MAN
 def load_data_sentilex(file_path,flag=1):
@@ -104,34 +383,321 @@ def load_data_sentilex(file_path,flag=1):
             data[word] = polarity #dps tratar o pos
             if pos=="IDIOM":
                 expressions.add(word)
-                pattern = []
-                for pal in word.split(" "):
-                    pattern.append({"LOWER":pal})    
-                matcher.add(word, [pattern])
     return expressions,data
 
-def analyze_sentiment_sentence(text):
+# Índice único dos léxicos de pontuação (boosters, emoticons e emoções): cada
+# termo, interned, aponta para um registo compacto, um inteiro pequeno com a
+# categoria nos dois bits de baixo e a polaridade nos restantes. Cada token é
+# procurado uma só vez. O índice é só de leitura, o que o torna partilhável
+# pelos workers criados por fork.
+BOOSTER, EMOTICON, EMOTION = 1, 2, 3
 
-    text = text.lower()
-    doc = nlp(text)
-    #transformar tudo nos seus lemmas
-    texto_com_lemmas = " ".join([token.lemma_ if token.pos_ == "VERB" else token.text for token in doc])
-    doc = nlp(texto_com_lemmas)
-    
-    
-    matches = matcher(doc)
+class LexiconIndex(dict):
+    # lexicons: pares (categoria, {termo: polaridade}), do menos para o mais prioritário
+    def __init__(self, lexicons=()):
+        super().__init__()
+        for category, lexicon in lexicons:
+            for term, polarity in lexicon.items():
+                dict.__setitem__(self, sys.intern(term), polarity << 2 | category)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("the lexicon index is read-only")
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    @classmethod
+    def from_records(cls, records):
+        index = cls()
+        for term, record in records.items():
+            dict.__setitem__(index, sys.intern(term), record)
+        return index
+
+    # bytes ocupados pela tabela, pelas chaves e pelos registos que não são
+    # inteiros partilhados
+    def footprint(self):
+        size = sys.getsizeof(self) + sum(sys.getsizeof(term) for term in self)
+        return size + sum(sys.getsizeof(record) for record in set(self.values()) if not -5 <= record <= 256)
+
+# padrões do PhraseMatcher: um Doc por expressão, com o NORM de cada token
+# igual à palavra, que é o atributo comparado com o NORM das frases. O
+# PhraseMatcher guarda-os numa árvore de prefixos, por isso o custo de
+# procurar numa frase não cresce com o número de expressões.
+def idiom_docs(vocab, expressions):
+    docs = []
+    for expression in expressions:
+        words = expression.split(" ")
+        doc = Doc(vocab, words=words)
+        for token, word in zip(doc, words):
+            token.norm_ = word
+        docs.append(doc)
+    return docs
+
+# Snapshot dos datasets: todos os léxicos e padrões já processados num único
+# ficheiro binário, lido de uma vez pelo init(). É reconstruído sempre que a
+# versão do formato ou algum dos ficheiros .txt de origem muda. São dois
+# registos pickle: o cabeçalho (versão e origens), verificado antes de ler o
+# resto, e os léxicos, só com tipos da biblioteca padrão (o índice é guardado
+# como dict e reconstruído ao ler), para não depender de classes deste módulo.
+SNAPSHOT_PATH = 'data/lexicons.snapshot'
+SNAPSHOT_VERSION = 5
+LEXICON_SOURCES = [
+    'data/BoosterWordList.txt',
+    'data/EmoticonLookupTable.txt',
+    'data/palavras.txt',
+    'data/EmotionLookupTable.txt',
+    'data/IronyTerms.txt',
+    'data/NegatingWordList.txt',
+    'data/QuestionWords.txt',
+    'data/SlangLookupTable.txt',
+]
+
+def sources_fingerprint():
+    fingerprint = []
+    for path in LEXICON_SOURCES:
+        stat = os.stat(path)
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return fingerprint
+
+def build_lexicons():
+    lexicons = {}
+    expressions, sentilex = load_data_sentilex('data/palavras.txt')
+    lexicons['expressions'] = expressions
+    # do menos para o mais prioritário: a EmotionLookupTable sobrepõe-se ao
+    # Sentilex, os emoticons às emoções e os boosters a tudo
+    lexicons['lexicon_index'] = LexiconIndex([
+        (EMOTION, sentilex),
+        (EMOTION, load_data('data/EmotionLookupTable.txt')),
+        (EMOTICON, load_data('data/EmoticonLookupTable.txt')),
+        (BOOSTER, load_data('data/BoosterWordList.txt')),
+    ])
+    lexicons['irony_terms'] = load_set('data/IronyTerms.txt')
+    lexicons['negating_words'] = load_set('data/NegatingWordList.txt')
+    lexicons['question_words'] = load_set('data/QuestionWords.txt')
+    lexicons['slang_lookup_table'] = load_data('data/SlangLookupTable.txt',0)
+    return lexicons
+
+def build_snapshot(snapshot_path=SNAPSHOT_PATH):
+    lexicons = build_lexicons()
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'sources': sources_fingerprint(),
+    }
+    payload = dict(lexicons, lexicon_index=dict(lexicons['lexicon_index']))
+    # escrever para um ficheiro temporário e substituir, para que um processo
+    # concorrente nunca leia um snapshot a meio
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"Could not write lexicon snapshot {snapshot_path}: {e}")
+    return lexicons
+
+def load_lexicons(snapshot_path=SNAPSHOT_PATH):
+    # qualquer erro ao ler (ficheiro em falta, truncado ou de outra versão)
+    # conta como snapshot desatualizado
+    try:
+        with open(snapshot_path, 'rb') as file:
+            header = pickle.load(file)
+            if header['version'] == SNAPSHOT_VERSION and header['sources'] == sources_fingerprint():
+                lexicons = pickle.load(file)
+                lexicons['lexicon_index'] = LexiconIndex.from_records(lexicons['lexicon_index'])
+                return lexicons
+    except Exception:
+        pass
+    print("Building lexicon snapshot...")
+    return build_snapshot(snapshot_path)
+
+# Pistas de ironia, negação e pergunta: todos os termos de todas as classes
+# são compilados numa única expressão regular em forma de árvore de prefixos
+# (trie), que percorre o texto uma só vez com um custo que não cresce com o
+# número de termos. Os termos só são reconhecidos como palavras inteiras
+# ("não" não é encontrado dentro de "canão"), exceto do lado em que começam
+# ou acabam com pontuação, como os emoticons ";)".
+def compile_cues(classes):
+    cue_classes = {}
+    for cue_class, terms in classes.items():
+        for term in terms:
+            if term:
+                cue_classes.setdefault(term.lower(), []).append(cue_class)
+    trie = {}
+    for term in cue_classes:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        # fim de um termo: exigir fronteira de palavra se acabar numa letra
+        node[''] = r'(?!\w)' if re.match(r'\w', term[-1]) else ''
+    alternatives = []
+    for char in sorted(trie):
+        prefix = r'(?<!\w)' if re.match(r'\w', char) else ''
+        alternatives.append(prefix + re.escape(char) + trie_regex(trie[char]))
+    # lookahead com captura: encontra termos sobrepostos em posições diferentes
+    return re.compile('(?=(' + '|'.join(alternatives) + '))'), cue_classes
+
+def trie_regex(node):
+    # termos mais longos primeiro; o fim de termo ('') é a última alternativa
+    alternatives = [re.escape(char) + trie_regex(node[char]) for char in sorted(node) if char]
+    if '' in node:
+        alternatives.append(node[''])
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return '(?:' + '|'.join(alternatives) + ')'
+
+# devolve, para cada classe de pista, a lista de (termo, posição) encontrados
+def scan_cues(text):
+    cues = {cue_class: [] for cue_class in ('ironia', 'negadores', 'perguntas')}
+    if cue_classes:
+        for match in cue_regex.finditer(text):
+            term = match.group(1)
+            for cue_class in cue_classes[term]:
+                cues[cue_class].append((term, match.start()))
+    return cues
+
+# (ironia, negação, pergunta), sem guardar os termos encontrados
+def cue_flags(text):
+    found = set()
+    if cue_classes:
+        for match in cue_regex.finditer(text):
+            found.update(cue_classes[match.group(1)])
+            if len(found) == 3:
+                break
+    return 'ironia' in found, 'negadores' in found, 'perguntas' in found
+
+def unique_terms(cues):
+    return list(dict.fromkeys(term for term, _ in cues))
+
+#transformar tudo nos seus lemmas
+def lemma_form(token):
+    return token.lemma_ if token.pos_ == "VERB" else token.text
+
+def lemmatize(doc):
+    return " ".join([lemma_form(token) for token in doc])
+
+# por omissão o texto passa uma só vez pelo nlp: a forma lematizada de cada
+# token fica no atributo NORM, que é o que o matcher e a pontuação usam;
+# com reparse=True mantém-se o comportamento antigo (reanalisar o texto lematizado)
+def analyze_sentiment_sentence(text, reparse=False):
+
+    sentence, text = text, text.lower()
+    key = cache_key(sentence, text, reparse)
+    if sentence_cache is not None:
+        avaliacao = sentence_cache.get(key)
+        if avaliacao is not None:
+            return avaliacao
+    if analysis_engine == 'fast':
+        avaliacao = fast_sentence(text)
+    else:
+        with stage('nlp'):
+            doc = nlp(text)
+        if reparse:
+            with stage('reparse'):
+                doc = nlp(lemmatize(doc))
+        avaliacao = score_doc(text, doc, reparse)
+    if leia_analyzer is not None:
+        with stage('leia'):
+            avaliacao = combine(avaliacao, leia_analyzer.polarity_scores_words(sentence.split()))
+    if sentence_cache is not None:
+        avaliacao = sentence_cache.put(key, avaliacao)
+    return avaliacao
+
+# no ensemble a chave é a frase original: o LeIA distingue maiúsculas
+def cache_key(sentence, text, reparse):
+    return (text if leia_analyzer is None else sentence, reparse)
+
+# analisar várias frases de uma vez: as frases são lidas em janelas, ordenadas
+# por comprimento e passadas ao nlp.pipe em lotes de batch_size, para que cada
+# lote tenha frases de tamanho semelhante; os resultados saem pela ordem original
+def analyze_sentiments(sentences, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    for _, avaliacao in analyze_pairs(sentences, batch_size, reparse):
+        yield avaliacao
+
+# como analyze_sentiments, mas gera pares (frase, avaliação); serve para
+# iteradores que só podem ser percorridos uma vez
+def analyze_pairs(sentences, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    sentences = iter(sentences)
+    while window := list(islice(sentences, batch_size * BUCKETS_PER_WINDOW)):
+        yield from zip(window, analyze_window(window, batch_size, reparse))
+
+def analyze_window(sentences, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    texts = [sentence.lower() for sentence in sentences]
+    if sentence_cache is None:
+        return score_texts(sentences, texts, batch_size, reparse)
+    # com cache, só as frases que lá não estão (sem repetições) passam pelo
+    # nlp. Cada frase distinta é procurada uma vez; as outras ocorrências na
+    # janela contam como acertos, como se as frases fossem analisadas uma a uma.
+    keys = [cache_key(sentence, text, reparse) for sentence, text in zip(sentences, texts)]
+    first = {}
+    for i, key in enumerate(keys):
+        first.setdefault(key, i)
+    cached = {key: sentence_cache.get(key) for key in first}
+    sentence_cache.add_hits(len(keys) - len(first))
+    misses = [key for key, avaliacao in cached.items() if avaliacao is None]
+    avaliacoes = score_texts([sentences[first[key]] for key in misses], [texts[first[key]] for key in misses], batch_size, reparse)
+    for key, avaliacao in zip(misses, avaliacoes):
+        cached[key] = sentence_cache.put(key, avaliacao)
+    return [cached[key] for key in keys]
+
+# no ensemble, junta a cada avaliação a do LeIA, a partir das mesmas palavras
+def score_texts(sentences, texts, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    avaliacoes = parse_texts(texts, batch_size, reparse)
+    if leia_analyzer is None:
+        return avaliacoes
+    with stage('leia'):
+        polarities = leia_analyzer.polarity_scores_words_batch([sentence.split() for sentence in sentences])
+    return [combine(avaliacao, polarity) for avaliacao, polarity in zip(avaliacoes, polarities)]
+
+def parse_texts(texts, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    if analysis_engine == 'fast':
+        return [fast_sentence(text) for text in texts]
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    with stage('nlp'):
+        docs = list(nlp.pipe([texts[i] for i in order], batch_size=batch_size))
+    if reparse:
+        with stage('reparse'):
+            docs = list(nlp.pipe([lemmatize(doc) for doc in docs], batch_size=batch_size))
+    avaliacoes = [None] * len(texts)
+    for i, doc in zip(order, docs):
+        avaliacoes[i] = score_doc(texts[i], doc, reparse)
+    return avaliacoes
+
+def score_doc(text, doc, reparse=False):
+    # o matcher procura as expressões no NORM: forma lematizada numa só
+    # passagem, texto em minúsculas no modo reparse
+    with stage('match'):
+        for token in doc:
+            token.norm_ = token.lower_ if reparse else lemma_form(token)
+        # expressões sobrepostas: ficam as mais longas (e, entre iguais, a
+        # primeira), como no motor rápido; o retokenize não junta spans sobrepostos
+        spans = filter_spans(matcher(doc, as_spans=True))
+    count('sentences', 1)
+    count('tokens', len(doc))
+    count('matches', len(spans))
     
     #print(texto_com_lemmas,matches)
     # Juntar multiwords
-    with doc.retokenize() as retokenizer:
-        for _, start, end in matches:
-            span = doc[start:end]
-            retokenizer.merge(span)
+    with stage('retokenize'), doc.retokenize() as retokenizer:
+        for span in spans:
+            retokenizer.merge(span, attrs={"NORM": " ".join([token.norm_ for token in span])})
             
             
     # remover pontuação
     doc = [token for token in doc if not token.is_punct]
 
+    if len(text.split(" ")) <= 1:
+        lemmas = [token.lemma_ for token in doc]
+    elif reparse:
+        lemmas = [token.text for token in doc]
+    else:
+        lemmas = [token.norm_ for token in doc]
+    return score_lemmas(text, lemmas)
+
+# pontuação a partir das formas (lemas e expressões) de uma frase, comum aos
+# dois motores
+def score_lemmas(text, lemmas):
+    if not collect_evidence:
+        return score_only(text, lemmas)
     avaliacao = {}
     evidencias = {}
     evidencias['positivas'] = []
@@ -142,45 +708,44 @@ def analyze_sentiment_sentence(text):
     evidencias['ironia'] = []
     evidencias['emotions'] = []
     
-    num_palavras = doc.__len__()
+    num_palavras = len(lemmas)
     sentiment_score = 0
     boost = 1
     
-    for token in doc:
-        if len(text.split(" ")) > 1:
-            lemma = token.text
-        else:
-            lemma = token.lemma_
-        
-        token_score = 0
-        if lemma in booster_words:
-            token_score = booster_words[lemma]
-            evidencias['boosters'].append((lemma,token_score))
-            boost += token_score
+    with stage('lexicon'):
+        for lemma in lemmas:
             token_score = 0
-        elif lemma in emoticons:
-            token_score = emoticons[lemma]
-            evidencias['emotions'].append((lemma,token_score))
-        elif lemma in emotions:
-            token_score = emotions[lemma]
-            evidencias['emotions'].append((lemma,token_score))
+            record = lexicon_index.get(lemma)
+            if record is None:
+                pass
+            elif record & 3 == BOOSTER:
+                token_score = record >> 2
+                evidencias['boosters'].append((lemma,token_score))
+                boost += token_score
+                token_score = 0
+            else:
+                token_score = record >> 2
+                evidencias['emotions'].append((lemma,token_score))
         
-        sentiment_score += token_score
+            sentiment_score += token_score
             
-        if token_score > 0:
-            evidencias['positivas'].append((lemma,token_score))
-        elif token_score < 0:
-            evidencias['negativas'].append((lemma,token_score))
-        else:
-            evidencias['neutras'].append(lemma)
+            if token_score > 0:
+                evidencias['positivas'].append((lemma,token_score))
+            elif token_score < 0:
+                evidencias['negativas'].append((lemma,token_score))
+            else:
+                evidencias['neutras'].append(lemma)
+    count('lexicon_hits', len(evidencias['boosters']) + len(evidencias['emotions']))
 
-    has_irony = any(term in text for term in irony_terms)
-    evidencias['ironia'] += [term for term in irony_terms if term in text]
+    with stage('cues'):
+        cues = scan_cues(text)
+    has_irony = bool(cues['ironia'])
+    evidencias['ironia'] += unique_terms(cues['ironia'])
     
-    has_negation = any(term in text for term in negating_words)
-    evidencias['negadores'] += [term for term in negating_words if term in text]
+    has_negation = bool(cues['negadores'])
+    evidencias['negadores'] += unique_terms(cues['negadores'])
     
-    is_question = any(term in text for term in question_words)
+    is_question = bool(cues['perguntas'])
     
     sentiment_score*=boost
 
@@ -200,87 +765,976 @@ def analyze_sentiment_sentence(text):
     
     return avaliacao
 
-def analyze_sentiment_book(book_path):
+# a mesma pontuação que score_lemmas, sem evidências: não cria listas nem
+# tuplos por token, e a procura de pistas para logo que as três aparecem
+def score_only(text, lemmas):
+    sentiment_score = 0
+    boost = 1
+    hits = 0
+    with stage('lexicon'):
+        for lemma in lemmas:
+            record = lexicon_index.get(lemma)
+            if record is None:
+                continue
+            hits += 1
+            if record & 3 == BOOSTER:
+                boost += record >> 2
+            else:
+                sentiment_score += record >> 2
+    count('lexicon_hits', hits)
+
+    with stage('cues'):
+        has_irony, has_negation, is_question = cue_flags(text)
+    sentiment_score*=boost
+    if has_irony:
+        sentiment_score *= -1
+    if has_negation:
+        sentiment_score *= -1
+    if is_question:
+        sentiment_score *= 0.5
+    return {'texto': text, 'score': sentiment_score, 'num_palavras': len(lemmas)}
+
+# Motor rápido: a mesma pontuação sem modelo do spaCy. O texto é partido por
+# expressões regulares que imitam o tokenizador do spaCy para português, os
+# lemas vêm de uma tabela pré-calculada (forma -> lema, classe) e as
+# expressões são procuradas numa árvore de prefixos, palavra a palavra.
+LEMMA_TABLE_PATH = 'data/LemmaTable.txt'
+# primeira linha da tabela: o modelo, as versões e o corpus com que foi gerada
+LEMMA_TABLE_HEADER = '#lemma-table '
+# o espaço que se segue a cada token não conta; o resto do espaço em branco
+# forma tokens próprios, como no spaCy
+CHUNK_REGEX = re.compile(r'(\S+)|(\s+)')
+# abreviaturas de uma letra ("j."), palavras com hífenes, apóstrofos e
+# números decimais, e sequências de outros caracteres
+TOKEN_REGEX = re.compile(r"^[^\W\d_]\.$|\w+(?:[-'’]\w+|(?<=\d)[.,]\d+)*|[^\w\s]+")
+
+def init_fast(model=DEFAULT_MODEL, exclude=EXCLUDED_COMPONENTS):
+    ensure_lemma_table(model, exclude)
+    global lemma_table, lemma_table_info, idioms
+    lemma_table, lemma_table_info = load_lemma_table()
+    idioms = idiom_trie(expressions)
+
+# Sem a tabela o motor rápido não lematizaria e daria, sem aviso, resultados
+# diferentes dos do spaCy. Se faltar, é gerada uma vez com o modelo, quando
+# está instalado; sem modelo, a falta da tabela é um erro.
+def ensure_lemma_table(model=DEFAULT_MODEL, exclude=EXCLUDED_COMPONENTS, path=LEMMA_TABLE_PATH):
+    if os.path.isfile(path):
+        return
+    model = MODELS.get(model, model)
+    if not spacy.util.is_package(model):
+        die(f"Lemma table {path} not found and the spaCy model {model} is not installed: the fast "
+            "engine cannot run without them. Build the table with --build-lemma-table where the "
+            "model is installed and copy it here.")
+    print(f"Lemma table {path} not found: building it with {model} (only once)...")
+    global nlp
+    previous = globals().get('nlp')
+    nlp = spacy.load(model, exclude=exclude)
+    try:
+        load_datasets()
+        table = build_lemma_table(path=path)
+    finally:
+        nlp = previous
+    print(f"Lemma table with {len(table)} forms written to {path}")
+
+# devolve a tabela e a descrição da primeira linha (modelo e corpus usados)
+def load_lemma_table(path=LEMMA_TABLE_PATH):
+    table, info = {}, {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.startswith(LEMMA_TABLE_HEADER):
+                info = json.loads(line[len(LEMMA_TABLE_HEADER):])
+                continue
+            form, lemma, pos = line.rstrip('\n').split('\t')
+            table[form] = (lemma, pos)
+    return table, info
+
+# árvore de prefixos das expressões, palavra a palavra; None marca o fim
+def idiom_trie(expressions):
+    trie = {}
+    for expression in expressions:
+        node = trie
+        for word in expression.split(" "):
+            node = node.setdefault(word, {})
+        node[None] = expression
+    return trie
+
+def is_punct(token):
+    return not token[0].isalnum() and all(unicodedata.category(char).startswith('P') for char in token)
+
+def fast_tokenize(text):
+    tokens = []
+    word = False
+    for match in CHUNK_REGEX.finditer(text):
+        chunk, space = match.groups()
+        if space:
+            if word and space[0] == ' ':
+                space = space[1:]
+            if space:
+                tokens.append(space)
+            word = False
+            continue
+        word = True
+        if lexicon_index.get(chunk, 0) & 3 == EMOTICON:
+            tokens.append(chunk)
+            continue
+        for token in TOKEN_REGEX.findall(chunk):
+            if len(token) > 2 and token[-2:] in ("'s", "’s"):
+                tokens += [token[:-2], token[-2:]]
+            else:
+                tokens.append(token)
+    return tokens
+
+# todas as ocorrências das expressões e, das sobrepostas, as mais longas e,
+# entre iguais, a primeira (a mesma escolha que o filter_spans do spaCy)
+def match_idioms(norms):
+    matches = []
+    for i in range(len(norms)):
+        node = idioms
+        for j in range(i, len(norms)):
+            node = node.get(norms[j])
+            if node is None:
+                break
+            if None in node:
+                matches.append((i, j + 1))
+    if len(matches) < 2:
+        return matches
+    spans, taken = [], set()
+    for start, end in sorted(matches, key=lambda span: (span[1] - span[0], -span[0]), reverse=True):
+        if not taken.intersection(range(start, end)):
+            spans.append((start, end))
+            taken.update(range(start, end))
+    return sorted(spans)
+
+def fast_lemmas(text):
+    tokens = fast_tokenize(text)
+    entries = [lemma_table.get(token) for token in tokens]
+    norms = [entry[0] if entry and entry[1] == 'VERB' else token for token, entry in zip(tokens, entries)]
+    # frases de uma só palavra usam o lema de qualquer classe, como no spaCy
+    if len(text.split(" ")) <= 1:
+        forms = [entry[0] if entry else token for token, entry in zip(tokens, entries)]
+    else:
+        forms = norms
+    with stage('match'):
+        spans = match_idioms(norms)
+    count('sentences', 1)
+    count('tokens', len(tokens))
+    count('matches', len(spans))
+    lemmas = []
+    i = 0
+    for start, end in spans + [(len(tokens), len(tokens))]:
+        lemmas += [form for token, form in zip(tokens[i:start], forms[i:start]) if not is_punct(token)]
+        if start < end:
+            lemmas.append(" ".join(norms[start:end]))
+        i = end
+    return lemmas
+
+def fast_sentence(text):
+    return score_lemmas(text, fast_lemmas(text))
+
+# Gera a tabela de lemas com o modelo do spaCy: as entradas dos léxicos, as
+# formas do vocabulário do modelo com o mesmo início de uma entrada (as
+# flexões possíveis) e, se forem dados, os tokens de um corpus. Só se guardam
+# as formas cujo lema é diferente da forma; no corpus vale a análise mais
+# frequente. Um livro usado no corpus não serve para medir a concordância.
+def build_lemma_table(corpus_paths=(), path=LEMMA_TABLE_PATH, batch_size=DEFAULT_BATCH_SIZE):
+    vocabulary = set(lexicon_index)
+    vocabulary |= {word for expression in expressions for word in expression.split(" ")}
+    entries = {word for word in vocabulary if " " not in word}
+    prefixes = {word[:3] for word in entries if word.isalpha()}
+    candidates = {form for form in nlp.vocab.strings
+                  if form.isalpha() and form.islower() and form[:3] in prefixes}
+    table = {}
+    for doc in nlp.pipe(sorted(entries | candidates), batch_size=batch_size):
+        if len(doc) != 1:
+            continue
+        token = doc[0]
+        if token.lemma_ != token.text and (token.text in entries or token.lemma_ in vocabulary):
+            table[token.text] = (token.lemma_, token.pos_)
+    analyses = defaultdict(lambda: defaultdict(int))
+    for corpus_path in corpus_paths:
+        sentences = [sentence.lower() for _, chapter in iter_chapters(corpus_path) for sentence in chapter]
+        for doc in nlp.pipe(sentences, batch_size=batch_size):
+            for token in doc:
+                if not token.is_punct and not token.is_space:
+                    analyses[token.text][token.lemma_, token.pos_] += 1
+    for form, counts in analyses.items():
+        lemma, pos = max(counts, key=counts.get)
+        if lemma != form:
+            table[form] = (lemma, pos)
+        else:
+            table.pop(form, None)
+    info = {'model': f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}", 'model_version': nlp.meta.get('version'),
+            'spacy': spacy.__version__, 'corpus': [os.path.basename(corpus_path) for corpus_path in corpus_paths]}
+    # escrever para um ficheiro temporário e substituir, como o snapshot
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(LEMMA_TABLE_HEADER + json.dumps(info) + '\n')
+        for form in sorted(table):
+            file.write(f"{form}\t{table[form][0]}\t{table[form][1]}\n")
+    os.replace(tmp_path, path)
+    return table
+
+# concordância do motor rápido com o spaCy (frases com a mesma pontuação)
+def engine_agreement(book_path, batch_size=DEFAULT_BATCH_SIZE):
+    sentences = [sentence for _, chapter in iter_chapters(book_path) for sentence in chapter]
+    same_score = same_sign = 0
+    for sentence, avaliacao in zip(sentences, analyze_sentiments(sentences, batch_size)):
+        fast = fast_sentence(sentence.lower())
+        same_score += fast['score'] == avaliacao['score']
+        same_sign += (fast['score'] > 0) - (fast['score'] < 0) == (avaliacao['score'] > 0) - (avaliacao['score'] < 0)
+    total = max(len(sentences), 1)
+    print(f"Agreement with spaCy on {len(sentences)} sentences: "
+          f"{same_score / total:.2%} same score, {same_sign / total:.2%} same polarity")
+    print(f"(spaCy model: {nlp.meta.get('lang')}_{nlp.meta.get('name')} {nlp.meta.get('version')}; lemma table: "
+          f"{lemma_table_info.get('model', 'unknown')} {lemma_table_info.get('model_version', '')}, "
+          f"corpus: {', '.join(lemma_table_info.get('corpus', [])) or 'none'})")
+    if os.path.basename(book_path) in lemma_table_info.get('corpus', []):
+        print(f"Warning: the lemma table was built from {book_path}, so this agreement is not "
+              "measured on held-out text. Rebuild the table without it (--build-lemma-table without -f).")
+    return same_score / total, same_sign / total
+
+# Ensemble: cada frase é pontuada pelo Sentilex (este analisador) e pelo
+# LeIA (data/datasets/LeIA), numa só passagem pelo texto; as palavras da
+# frase (split) são calculadas uma vez e dadas ao LeIA. A pontuação combinada
+# é a média das duas, depois de normalizar a do Sentilex para [-1, 1] com o
+# normalize() do LeIA (a mesma escala do compound).
+LEIA_PATH = 'data/datasets/LeIA/leia.py'
+leia_analyzer = None
+
+def load_leia(path=LEIA_PATH):
+    spec = importlib.util.spec_from_file_location('leia', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def combine(avaliacao, polarity):
+    combined = dict(avaliacao)
+    combined['score_sentilex'] = avaliacao['score']
+    combined['score_leia'] = polarity['compound']
+    combined['score'] = (leia.normalize(avaliacao['score']) + polarity['compound']) / 2
+    return combined
+
+# Ler o livro incrementalmente, linha a linha: os capítulos são denotados por
+# '#' (em qualquer ponto do texto) e o resto da linha depois do '#' é o número
+# do capítulo; cada linha não vazia seguinte é uma frase. Gera eventos
+# (índice do capítulo, número, frase), com frase None no início de cada
+# capítulo, para que também os capítulos vazios apareçam. O texto antes do
+# primeiro '#' é ignorado, a não ser com preamble (capítulo 0, número None).
+def read_book(file, preamble=False):
+    index, number = 0, None
+    for line in file:
+        segments = line.rstrip('\n').split('#')
+        for j, segment in enumerate(segments):
+            if j > 0:
+                index, number = index + 1, segment
+                yield index, number, None
+            elif segment and (index or preamble):
+                yield index, number, segment
+
+# gera (número do capítulo, frases) à medida que o livro é lido; as frases de
+# cada capítulo têm de ser consumidas antes de passar ao capítulo seguinte
+def iter_chapters(book_path, preamble=False):
+    with open(book_path, 'r', encoding='utf-8') as file:
+        for (_, number), events in groupby(read_book(file, preamble), key=itemgetter(0, 1)):
+            yield number, (sentence for _, _, sentence in events if sentence is not None)
+
+# divide cada capítulo em blocos de frases (tarefas para os workers); cada
+# capítulo gera pelo menos um bloco, ainda que vazio
+def chapter_chunks(chapters, size):
+    for index, (number, sentences) in enumerate(chapters):
+        sentences = iter(sentences)
+        yield index, number, list(islice(sentences, size))
+        while chunk := list(islice(sentences, size)):
+            yield index, number, chunk
+
+# analisar um bloco de frases de um capítulo; é a tarefa de cada worker
+def analyze_chapter(sentences, reparse=False):
+    return list(zip(sentences, analyze_sentiments(sentences, reparse=reparse)))
+
+# devolve também os totais da instrumentação do worker, se estiver ligada
+def analyze_chunk(index, number, sentences, reparse=False):
+    pairs = analyze_chapter(sentences, reparse)
+    return index, number, pairs, profiler.take() if profiler is not None else None
+
+def chunk_pairs(chunks):
+    for _, _, pairs, totals in chunks:
+        if totals and profiler is not None:
+            profiler.merge(totals)
+        yield from pairs
+
+# aplica func a cada elemento num pool, devolvendo os resultados pela ordem
+# de entrada, com no máximo limit tarefas pendentes de cada vez
+def bounded_imap(pool, func, iterable, limit):
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, item))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# gera (número do capítulo, pares (frase, avaliação)) sem nunca ter o livro
+# inteiro em memória; com vários workers os blocos de frases são
+# distribuídos por um pool de processos, em que cada worker carrega o modelo
+# e os datasets uma vez (init no initializer)
+def analyze_chapters(chapters, reparse=False, workers=1, init_args=None, batch_size=DEFAULT_BATCH_SIZE):
+    if workers <= 1:
+        for number, sentences in chapters:
+            yield number, analyze_pairs(sentences, batch_size, reparse)
+        return
+    print(f"Starting {workers} workers...")
+    with Pool(workers, initializer=init, initargs=init_args or last_init_args) as pool:
+        chunks = chapter_chunks(chapters, batch_size * BUCKETS_PER_WINDOW)
+        tasks = ((index, number, sentences, reparse) for index, number, sentences in chunks)
+        results = bounded_imap(pool, analyze_chunk, tasks, 2 * workers)
+        for (_, number), chunks in groupby(results, key=itemgetter(0, 1)):
+            yield number, chunk_pairs(chunks)
+
+# Formatos de saída do livro. Todos recebem os resultados por ordem:
+# start_chapter, write_sentence por cada frase, end_chapter, e close no fim.
+OUTPUT_FORMATS = ('text', 'jsonl', 'csv')
+# tamanho do buffer dos ficheiros de saída
+OUTPUT_BUFFER_SIZE = 2**20
+
+# relatório legível, um ficheiro chapter_N.txt por capítulo
+class TextWriter:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.file = None
+
+    def chapter_path(self, index):
+        return os.path.join(self.output_dir, f'chapter_{index}.txt')
+
+    def start_chapter(self, index, number):
+        self.file = open(self.chapter_path(index), 'w', buffering=OUTPUT_BUFFER_SIZE)
+        self.file.write(f"\nChapter {number}\n")
+
+    def write_sentence(self, sentence, avaliacao):
+        lines = [f"\nPhrase: {sentence}\n",
+                 f"Word count: {avaliacao['num_palavras']}\n",
+                 f"Sentiment Score: {avaliacao['score']}\n"]
+        if 'score_sentilex' in avaliacao:
+            lines += [f"Sentilex Score: {avaliacao['score_sentilex']}\n",
+                      f"LeIA Score: {avaliacao['score_leia']}\n"]
+        if 'evidencias' in avaliacao:
+            lines.append("Evidences:\n")
+            for key in avaliacao['evidencias']:
+                lines.append(f"\t{key}: {list(avaliacao['evidencias'][key])}\n")
+        lines.append("\n")
+        self.file.write(''.join(lines))
+
+    def end_chapter(self, score, num_sentences):
+        self.file.write(f"\nChapter Score: {score}\n\n")
+        self.file.close()
+
+    def close(self):
+        pass
+
+# pontuações das duas partes do ensemble, quando presentes
+ENSEMBLE_FIELDS = ('score_sentilex', 'score_leia')
+
+# um registo por frase em sentences.<formato> e um resumo por capítulo em
+# chapters.<formato>, sempre nos mesmos dois ficheiros
+class RecordWriter:
+    extension = None
+
+    def __init__(self, output_dir):
+        self.sentences = self.open(output_dir, 'sentences')
+        self.chapters = self.open(output_dir, 'chapters')
+
+    def open(self, output_dir, name):
+        path = os.path.join(output_dir, f'{name}.{self.extension}')
+        return open(path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE)
+
+    def start_chapter(self, index, number):
+        self.chapter, self.number, self.sentence_index = index, number.strip(), 0
+
+    # os registos vão todos para os mesmos ficheiros, que são sempre reescritos
+    def chapter_path(self, index):
+        return None
+
+    def close(self):
+        self.sentences.close()
+        self.chapters.close()
+
+class JsonlWriter(RecordWriter):
+    extension = 'jsonl'
+
+    def write_sentence(self, sentence, avaliacao):
+        self.sentence_index += 1
+        record = {
+            'chapter': self.chapter,
+            'chapter_number': self.number,
+            'index': self.sentence_index,
+            'sentence': sentence,
+            'score': avaliacao['score'],
+            'num_palavras': avaliacao['num_palavras'],
+        }
+        if 'evidencias' in avaliacao:
+            record['evidencias'] = avaliacao['evidencias']
+        for field in ENSEMBLE_FIELDS:
+            if field in avaliacao:
+                record[field] = avaliacao[field]
+        self.sentences.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def end_chapter(self, score, num_sentences):
+        record = {'chapter': self.chapter, 'chapter_number': self.number,
+                  'score': score, 'num_sentences': num_sentences}
+        self.chapters.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+class CsvWriter(RecordWriter):
+    extension = 'csv'
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir)
+        self.sentences_csv = csv.writer(self.sentences)
+        self.fields = None
+        self.chapters_csv = csv.writer(self.chapters)
+        self.chapters_csv.writerow(['chapter', 'chapter_number', 'score', 'num_sentences'])
+
+    # o cabeçalho só é escrito com a primeira frase, que diz se há colunas do ensemble
+    def write_header(self, avaliacao):
+        self.fields = [field for field in ENSEMBLE_FIELDS if field in avaliacao]
+        self.sentences_csv.writerow(['chapter', 'chapter_number', 'index', 'sentence', 'score', 'num_palavras', 'evidencias'] + self.fields)
+
+    def write_sentence(self, sentence, avaliacao):
+        if self.fields is None:
+            self.write_header(avaliacao)
+        self.sentence_index += 1
+        evidencias = json.dumps(avaliacao['evidencias'], ensure_ascii=False) if 'evidencias' in avaliacao else ''
+        self.sentences_csv.writerow([self.chapter, self.number, self.sentence_index, sentence,
+                                     avaliacao['score'], avaliacao['num_palavras'], evidencias]
+                                    + [avaliacao[field] for field in self.fields])
+
+    def end_chapter(self, score, num_sentences):
+        self.chapters_csv.writerow([self.chapter, self.number, score, num_sentences])
+
+    def close(self):
+        if self.fields is None:
+            self.write_header({})
+        super().close()
+
+WRITERS = {'text': TextWriter, 'jsonl': JsonlWriter, 'csv': CsvWriter}
+
+# Análise incremental: os resultados de cada frase ficam numa base de dados
+# SQLite na pasta de saída, com a chave (contexto, hash da frase). O contexto
+# é uma impressão digital de tudo o que muda os resultados: o conteúdo dos
+# léxicos, o modelo e a sua versão, o motor e o modo de análise. Numa nova
+# análise só as frases que não estão na base passam pelo analisador; um
+# capítulo com as mesmas frases, no mesmo lugar, não é reescrito.
+RESULTS_DB = 'results.sqlite'
+# mudar quando o formato ou o cálculo dos resultados mudar
+RESULTS_VERSION = 1
+
+def files_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        except OSError:
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+def analysis_fingerprint(init_args, reparse=False):
+    model, _, _, _, engine, ensemble, evidence = init_args
+    parts = [RESULTS_VERSION, SNAPSHOT_VERSION, files_digest(LEXICON_SOURCES), engine, reparse, ensemble, evidence]
+    if engine == 'fast':
+        parts.append(files_digest([LEMMA_TABLE_PATH]))
+    else:
+        model = MODELS.get(model, model)
+        parts += [model, spacy.__version__, spacy.util.get_package_version(model)]
+    if ensemble:
+        leia_directory = os.path.dirname(LEIA_PATH)
+        lexicons = sorted(os.listdir(os.path.join(leia_directory, 'lexicons')))
+        parts.append(files_digest([LEIA_PATH] + [os.path.join(leia_directory, 'lexicons', name)
+                                                 for name in lexicons if name.endswith('.txt')]))
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+def content_key(*parts):
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+class ResultStore:
+    # nº máximo de parâmetros por consulta
+    QUERY_SIZE = 500
+
+    def __init__(self, path, context):
+        self.context = context
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS sentences "
+                        "(context TEXT, key TEXT, result BLOB, PRIMARY KEY (context, key))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS chapters "
+                        "(context TEXT, path TEXT, key TEXT, mtime INTEGER, size INTEGER, PRIMARY KEY (context, path))")
+
+    def get(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), self.QUERY_SIZE):
+            chunk = keys[i:i + self.QUERY_SIZE]
+            rows = self.db.execute(f"SELECT key, result FROM sentences WHERE context = ? AND key IN "
+                                   f"({', '.join('?' * len(chunk))})", [self.context] + chunk)
+            for key, result in rows:
+                found[key] = pickle.loads(result)
+        return found
+
+    def put(self, items):
+        self.db.executemany("INSERT OR REPLACE INTO sentences VALUES (?, ?, ?)",
+                            [(self.context, key, pickle.dumps(avaliacao, protocol=pickle.HIGHEST_PROTOCOL))
+                             for key, avaliacao in items])
+
+    # o ficheiro do capítulo foi escrito por esta base, com este conteúdo, e
+    # não foi alterado desde então
+    def chapter_unchanged(self, key, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        row = self.db.execute("SELECT key, mtime, size FROM chapters WHERE context = ? AND path = ?",
+                              (self.context, path)).fetchone()
+        return row == (key, stat.st_mtime_ns, stat.st_size)
+
+    def put_chapter(self, key, path):
+        stat = os.stat(path)
+        self.db.execute("INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?)",
+                        (self.context, path, key, stat.st_mtime_ns, stat.st_size))
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# como analyze_chapters, mas só as frases que não estão na base de dados são
+# analisadas; gera (número do capítulo, pares, chave do capítulo). A deque
+# liga cada capítulo lido às suas frases em falta, que o analyze_chapters
+# devolve pela mesma ordem.
+def analyze_chapters_incremental(chapters, store, reparse=False, workers=1, init_args=None):
+    pending = deque()
+    def missing(chapters):
+        for index, (number, sentences) in enumerate(chapters):
+            sentences = list(sentences)
+            keys = [content_key(sentence) for sentence in sentences]
+            cached = store.get(set(keys))
+            misses = {key: sentence for sentence, key in zip(sentences, keys) if key not in cached}
+            chapter_key = content_key(str(index + 1), number, *keys)
+            pending.append((sentences, keys, cached, list(misses), chapter_key))
+            yield number, list(misses.values())
+    for number, results in analyze_chapters(missing(chapters), reparse, workers, init_args):
+        results = list(results)
+        sentences, keys, cached, miss_keys, chapter_key = pending.popleft()
+        store.put(zip(miss_keys, (avaliacao for _, avaliacao in results)))
+        cached.update(zip(miss_keys, (avaliacao for _, avaliacao in results)))
+        store.commit()
+        print(f"Chapter {number}: {len(miss_keys)} of {len(sentences)} sentences analysed")
+        yield number, [(sentence, cached[key]) for sentence, key in zip(sentences, keys)], chapter_key
+
+# gráficos do livro: formatos gerados e nº de janelas do arco de sentimento
+PLOT_FORMATS = ('png', 'svg')
+PLOT_DPI = 150
+ARC_WINDOWS = 50
+# resolução do arco: nº de intervalos de frases guardados (entre ARC_BINS e
+# 2 * ARC_BINS), qualquer que seja o tamanho do livro
+ARC_BINS = 1000
+
+# Arco de sentimento em memória constante: as pontuações das frases são
+# somadas em intervalos consecutivos de width frases. Quando há 2 * bins
+# intervalos cheios, são juntados dois a dois e width duplica. Até
+# 2 * bins frases cada intervalo é uma frase.
+class SentimentArc:
+    def __init__(self, bins=ARC_BINS):
+        self.bins = bins
+        self.width = 1
+        self.sums = []
+        self.counts = []
+        self.total = 0
+
+    def add(self, score):
+        if not self.counts or self.counts[-1] == self.width:
+            if len(self.counts) == 2 * self.bins:
+                self.sums = [self.sums[i] + self.sums[i + 1] for i in range(0, len(self.sums), 2)]
+                self.counts = [self.counts[i] + self.counts[i + 1] for i in range(0, len(self.counts), 2)]
+                self.width *= 2
+            self.sums.append(0)
+            self.counts.append(0)
+        self.sums[-1] += score
+        self.counts[-1] += 1
+        self.total += 1
+
+    # média móvel com uma janela de window frases (arredondada a intervalos
+    # inteiros): devolve a última frase de cada intervalo e a média nesse ponto
+    def moving_average(self, window):
+        span = max(1, round(window / self.width))
+        sums, counts = [0], [0]
+        for total, count in zip(self.sums, self.counts):
+            sums.append(sums[-1] + total)
+            counts.append(counts[-1] + count)
+        points = range(1, len(self.counts) + 1)
+        return ([counts[i] for i in points],
+                [(sums[i] - sums[max(0, i - span)]) / (counts[i] - counts[max(0, i - span)]) for i in points])
+
+def analyze_sentiment_book(book_path, reparse=False, workers=1, init_args=None, output_dir='chapters', output_format='text', plot=True, incremental=False):
     print(f"Loading book {book_path}...")
     all_scores = []
-    with open(book_path, 'r', encoding='utf-8') as file:
-        text = file.read()
-        print("Book loaded successfully!")
-        # dividir livro em capítulos (denotados por #)
-        chapters = text.split('#')
-        print("There are ", len(chapters[1:]), "chapters.")
-        
-        # criar pasta para guardar os capítulos, se não existir
-        if not os.path.exists('chapters'):
-            print("Creating chapters folder...")
-            os.makedirs('chapters')
-        os.chdir('chapters')
-        
-        # analisar cada capítulo
-        for i, chapter in enumerate(chapters[1:]):
-            with open(f'chapter_{i+1}.txt', 'w') as chapter_file:
-                # split por frases (\n) (primeira frase é o número do capítulo)
-                sentences = chapter.split('\n')
-                chapter_number = sentences.pop(0)                
-                chapter_file.write(f"\nChapter {chapter_number}\n")
-                chapter_score = 0
-                # separar por frases (\n)
-                # analisar cada frase
-                for sentence in sentences:
-                    if sentence:
-                        avaliacao = analyze_sentiment_sentence(sentence)
-                        chapter_file.write(f"\nPhrase: {sentence}\n")
-                        chapter_file.write(f"Word count: {avaliacao['num_palavras']}\n")
-                        chapter_file.write(f"Sentiment Score: {avaliacao['score']}\n")
-                        chapter_score += avaliacao['score']
-                        # imprimir evidencias
-                        chapter_file.write("Evidences:\n")
-                        for key in avaliacao['evidencias']:
-                            chapter_file.write(f"\t{key}: {avaliacao['evidencias'][key]}\n")
-                        chapter_file.write("\n")
-                chapter_file.write(f"\nChapter Score: {chapter_score}\n")
-                chapter_file.write("\n")
+    # só guardados para os gráficos
+    chapter_numbers, arc, chapter_ends = [], SentimentArc(), []
+    # criar pasta para guardar os capítulos, se não existir
+    if not os.path.exists(output_dir):
+        print(f"Creating {output_dir} folder...")
+        os.makedirs(output_dir)
+    
+    # analisar cada capítulo
+    writer = WRITERS[output_format](output_dir)
+    store = None
+    if incremental:
+        store = ResultStore(os.path.join(output_dir, RESULTS_DB),
+                            analysis_fingerprint(init_args or last_init_args, reparse))
+        chapters = analyze_chapters_incremental(iter_chapters(book_path), store, reparse, workers, init_args)
+    else:
+        chapters = ((number, results, None) for number, results in
+                    analyze_chapters(iter_chapters(book_path), reparse, workers, init_args))
+    try:
+        for i, (chapter_number, results, chapter_key) in enumerate(chapters):
+            if profiler is not None:
+                profiler.start_chapter(chapter_number)
+            chapter_score = 0
+            num_sentences = 0
+            path = writer.chapter_path(i + 1)
+            if store is not None and path and store.chapter_unchanged(chapter_key, path):
+                for sentence, avaliacao in results:
+                    chapter_score += avaliacao['score']
+                    num_sentences += 1
+                    if plot:
+                        arc.add(avaliacao['score'])
+            else:
+                writer.start_chapter(i + 1, chapter_number)
+                for sentence, avaliacao in results:
+                    writer.write_sentence(sentence, avaliacao)
+                    chapter_score += avaliacao['score']
+                    num_sentences += 1
+                    if plot:
+                        arc.add(avaliacao['score'])
+                writer.end_chapter(chapter_score, num_sentences)
+                if store is not None and path:
+                    store.put_chapter(chapter_key, path)
+            if profiler is not None:
+                profiler.end_chapter()
             print(f"Chapter {chapter_number} analysed -> sentiment score: {chapter_score}")
             all_scores.append(chapter_score)
-        os.chdir('..')
+            if plot:
+                chapter_numbers.append(str(chapter_number))
+                chapter_ends.append(arc.total)
+    finally:
+        writer.close()
+        if store is not None:
+            store.close()
+    print("There were ", len(all_scores), "chapters.")
     
     # all_scores = [-26, -4, -46.5, -30, 26.5, -6, -25, -26, -38, -32, -25, -16.5, -5.5, -15.5, -40, -45, -47.5]µ
-    hist_sentiment(all_scores)
+    if plot:
+        plot_sentiment(all_scores, chapter_numbers, arc, chapter_ends, output_dir)
     book_score = sum(all_scores)
     return book_score
 
-def hist_sentiment(scores):
-    # histograma com a pontuação de cada capítulo usando o matplotlib
-    # x -> pontuação (pode ser positiva ou negativa)
-    # y -> número de capítulos (17 capítulos)
-    capitulos = [i for i in range(17)]
+# o matplotlib só é importado quando há gráficos para desenhar. A Figure é
+# usada diretamente, sem o pyplot: não há backend interativo nem janelas, e o
+# savefig escolhe o canvas (Agg para PNG, SVG) pela extensão.
+def load_figure():
+    try:
+        from matplotlib.figure import Figure
+    except ImportError:
+        print("matplotlib is not installed: charts skipped (pip install matplotlib).")
+        return None
+    return Figure
+
+def save_figure(figure, output_dir, name, formats=PLOT_FORMATS):
+    paths = [os.path.join(output_dir, f"{name}.{format}") for format in formats]
+    for path in paths:
+        figure.savefig(path, dpi=PLOT_DPI)
+    return paths
+
+# gráficos do livro: a pontuação de cada capítulo e o arco de sentimento frase a frase
+def plot_sentiment(scores, chapter_numbers, arc, chapter_ends, output_dir, formats=PLOT_FORMATS):
+    if not scores or (Figure := load_figure()) is None:
+        return []
+    paths = hist_sentiment(scores, output_dir, chapter_numbers, formats, Figure)
+    paths += sentiment_arc(arc, chapter_ends, output_dir, formats, Figure)
+    print(f"Charts written to {', '.join(paths)}")
+    return paths
+
+def hist_sentiment(scores, output_dir='.', chapter_numbers=None, formats=PLOT_FORMATS, Figure=None):
+    # gráfico de barras com a pontuação de cada capítulo
+    # x -> capítulo (tantos quantos o livro tiver)
+    # y -> pontuação (pode ser positiva ou negativa)
+    Figure = Figure or load_figure()
+    if Figure is None:
+        return []
+    capitulos = range(len(scores))
+    figure = Figure(figsize=(max(6.4, 0.4 * len(scores)), 4.8), layout='constrained')
+    ax = figure.add_subplot()
+    ax.bar(capitulos, scores)
     # quero valores do score em cima das barras se forem positivos, em baixo se forem negativos
     for i, score in enumerate(scores):
-        if score > 0:
-            plt.text(i, score, score, ha='center', va='bottom')
-        else:
-            plt.text(i, score, score, ha='center', va='top')
-    plt.bar(capitulos, scores)
-    plt.title('Score per chapter')
-    plt.xlabel('Score')
-    plt.ylabel('Number of chapters')
-    plt.show()
+        ax.text(i, score, f"{score:g}", ha='center', va='bottom' if score > 0 else 'top', fontsize='small')
+    ax.set_xticks(capitulos, chapter_numbers or [str(i + 1) for i in capitulos])
+    ax.axhline(0, color='black', linewidth=0.5)
+    ax.set_title('Score per chapter')
+    ax.set_xlabel('Chapter')
+    ax.set_ylabel('Score')
+    return save_figure(figure, output_dir, 'chapter_scores', formats)
+
+# arco de sentimento (um SentimentArc): média móvel da pontuação das frases,
+# com uma janela de 1/ARC_WINDOWS do livro, e uma linha vertical no fim de
+# cada capítulo
+def sentiment_arc(arc, chapter_ends=(), output_dir='.', formats=PLOT_FORMATS, Figure=None):
+    Figure = Figure or load_figure()
+    if Figure is None or not arc.total:
+        return []
+    window = max(1, arc.total // ARC_WINDOWS)
+    x, y = arc.moving_average(window)
+    figure = Figure(figsize=(max(6.4, min(arc.total / 500, 24)), 4.8), layout='constrained')
+    ax = figure.add_subplot()
+    ax.plot(x, y, linewidth=1)
+    for end in chapter_ends[:-1]:
+        ax.axvline(end + 0.5, color='grey', linewidth=0.5, linestyle=':')
+    ax.axhline(0, color='black', linewidth=0.5)
+    ax.set_xlim(1, max(arc.total, 2))
+    ax.set_title(f'Sentiment arc (moving average of {window} sentences)')
+    ax.set_xlabel('Sentence')
+    ax.set_ylabel('Score')
+    return save_figure(figure, output_dir, 'sentiment_arc', formats)
     
-def user_input():
+# Modo corpus: cada ficheiro é uma tarefa inteira de um worker, e os maiores
+# são enviados primeiro, para que um ficheiro grande no fim não deixe os
+# outros workers parados. Cada ficheiro terminado é acrescentado ao diário
+# (corpus.jsonl); uma execução interrompida recomeça pelos ficheiros que não
+# estão lá. O texto antes do primeiro '#' também conta (capítulo None), para
+# que documentos sem capítulos tenham pontuação.
+CORPUS_JOURNAL = 'corpus.jsonl'
+CORPUS_REPORT = 'corpus_report.json'
+# nº de ficheiros mais positivos e mais negativos no resumo
+CORPUS_TOP = 10
+
+# ficheiros .txt de uma pasta (recursivamente), de um padrão glob ou de um
+# manifesto (um caminho por linha, relativo à pasta do manifesto)
+def corpus_files(spec):
+    if os.path.isdir(spec):
+        paths = (os.path.join(root, name) for root, _, names in os.walk(spec)
+                 for name in names if name.endswith('.txt'))
+    elif any(char in spec for char in '*?['):
+        paths = (path for path in glob.iglob(spec, recursive=True) if os.path.isfile(path))
+    elif os.path.isfile(spec):
+        base = os.path.dirname(spec)
+        with open(spec, 'r', encoding='utf-8') as manifest:
+            paths = [os.path.join(base, line.strip()) for line in manifest if line.strip()]
+    else:
+        raise FileNotFoundError(f"No directory, glob or manifest '{spec}'")
+    return sorted(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+# lê o diário: devolve {ficheiro: registo} se foi escrito com a mesma
+# configuração. Uma última linha incompleta (execução interrompida) é cortada;
+# sem um cabeçalho completo o diário não é usado (None) e é reescrito.
+def read_journal(path, fingerprint):
+    done = {}
+    try:
+        file = open(path, 'rb+')
+    except FileNotFoundError:
+        return None
+    with file:
+        offset = 0
+        for i, line in enumerate(file):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if i == 0 and record.get('fingerprint') != fingerprint:
+                return None
+            if i > 0:
+                done[record['file']] = record
+            offset += len(line)
+        if not offset:
+            return None
+        file.truncate(offset)
+    return done
+
+# tarefa de cada worker: pontuação de cada capítulo de um ficheiro
+def analyze_file(path, reparse=False):
+    try:
+        stat = os.stat(path)
+        chapters = []
+        for number, sentences in iter_chapters(path, preamble=True):
+            score = num_sentences = 0
+            for avaliacao in analyze_sentiments(sentences, reparse=reparse):
+                score += avaliacao['score']
+                num_sentences += 1
+            chapters.append({'chapter': number, 'score': score, 'sentences': num_sentences})
+    except (OSError, UnicodeDecodeError) as e:
+        return path, None, f"{type(e).__name__}: {e}"
+    return path, {'file': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                  'score': sum(chapter['score'] for chapter in chapters),
+                  'sentences': sum(chapter['sentences'] for chapter in chapters),
+                  'chapters': chapters}, None
+
+def analyze_corpus(spec, reparse=False, workers=1, init_args=None, output_dir='corpus'):
+    init_args = init_args or last_init_args
+    paths = corpus_files(spec)
+    os.makedirs(output_dir, exist_ok=True)
+    journal_path = os.path.join(output_dir, CORPUS_JOURNAL)
+    fingerprint = analysis_fingerprint(init_args, reparse)
+    done = read_journal(journal_path, fingerprint)
+    if done is None:
+        done = {}
+        with open(journal_path, 'w', encoding='utf-8') as journal:
+            journal.write(json.dumps({'fingerprint': fingerprint}) + '\n')
+
+    # ficheiros por fazer, ou alterados desde que foram analisados, dos maiores para os menores
+    sizes = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        record = done.get(path)
+        if record is None or (record['size'], record['mtime']) != (stat.st_size, stat.st_mtime_ns):
+            sizes[path] = stat.st_size
+    todo = sorted(sizes, key=sizes.get, reverse=True)
+    print(f"Corpus: {len(paths)} files, {len(paths) - len(todo)} already analysed, {len(todo)} to analyse")
+
+    errors = {path: "FileNotFoundError: missing" for path in paths if path not in sizes and path not in done}
+    tasks = ((path, reparse) for path in todo)
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        if workers <= 1:
+            results = (analyze_file_task(task) for task in tasks)
+            pool = nullcontext()
+        else:
+            print(f"Starting {workers} workers...")
+            pool = Pool(workers, initializer=init, initargs=init_args)
+            results = pool.imap_unordered(analyze_file_task, tasks)
+        with pool:
+            for i, (path, record, error, totals) in enumerate(results):
+                # a instrumentação de cada ficheiro, feita no worker, fica
+                # nos totais do pai e como uma entrada por ficheiro
+                if totals and profiler is not None:
+                    profiler.start_chapter(path)
+                    profiler.merge(totals)
+                    profiler.end_chapter()
+                if error:
+                    errors[path] = error
+                    print(f"[{i + 1}/{len(todo)}] {path}: {error}")
+                    continue
+                journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+                journal.flush()
+                done[path] = record
+                print(f"[{i + 1}/{len(todo)}] {path} -> sentiment score: {record['score']}")
+    return write_corpus_report([done[path] for path in paths if path in done], errors, output_dir)
+
+# devolve também os totais da instrumentação, como o analyze_chunk
+def analyze_file_task(task):
+    return (*analyze_file(*task), profiler.take() if profiler is not None else None)
+
+# relatório agregado: totais, ficheiros mais positivos/negativos, e a
+# pontuação de cada ficheiro e de cada um dos seus capítulos
+def write_corpus_report(records, errors, output_dir):
+    by_score = sorted(records, key=itemgetter('score'))
+    summary = {
+        'files': len(records),
+        'chapters': sum(len(record['chapters']) for record in records),
+        'sentences': sum(record['sentences'] for record in records),
+        'score': sum(record['score'] for record in records),
+        'mean_file_score': sum(record['score'] for record in records) / len(records) if records else 0,
+        'most_positive': [(record['file'], record['score']) for record in by_score[::-1][:CORPUS_TOP]],
+        'most_negative': [(record['file'], record['score']) for record in by_score[:CORPUS_TOP]],
+        'errors': errors,
+    }
+    path = os.path.join(output_dir, CORPUS_REPORT)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'summary': summary,
+                   'files': [{key: record[key] for key in ('file', 'score', 'sentences', 'chapters')}
+                             for record in records]},
+                  file, indent=1, ensure_ascii=False)
+    print(f"Corpus report written to {path}")
+    return summary
+
+# Modo --stream: uma linha de entrada (texto ou JSON {"text": ..., "id": ...})
+# dá uma linha JSONL de saída, pela mesma ordem. Uma thread lê o stdin para
+# uma fila limitada; o ciclo principal junta as linhas que já estão na fila
+# (até batch_size) num lote, analisa-o e escreve e despeja os resultados.
+# Quando a saída bloqueia, a fila enche e a leitura pára: a memória não
+# depende do tamanho da entrada.
+STREAM_QUEUE_BATCHES = 2
+
+# devolve (texto, id, erro); uma linha que não é JSON é analisada como texto
+def parse_stream_line(line):
+    text = line.rstrip('\r\n')
+    if not text.lstrip().startswith('{'):
+        return text, None, None
+    try:
+        record = json.loads(text)
+    except ValueError:
+        return text, None, None
+    if not isinstance(record.get('text'), str):
+        return None, record.get('id'), 'Expected {"text": "..."}'
+    return record['text'], record.get('id'), None
+
+def stream_batches(lines, batch_size):
+    while (line := lines.get()) is not None:
+        batch = [line]
+        while len(batch) < batch_size:
+            try:
+                line = lines.get_nowait()
+            except Empty:
+                break
+            if line is None:
+                yield batch
+                return
+            batch.append(line)
+        yield batch
+
+def stream_sentiments(input, output, batch_size=DEFAULT_BATCH_SIZE, reparse=False):
+    lines = Queue(maxsize=batch_size * STREAM_QUEUE_BATCHES)
+    def read():
+        try:
+            for line in input:
+                lines.put(line)
+        finally:
+            lines.put(None)
+    Thread(target=read, daemon=True).start()
+    total = 0
+    for batch in stream_batches(lines, batch_size):
+        parsed = [parse_stream_line(line.decode('utf-8', errors='replace')) for line in batch]
+        results = analyze_sentiments((text for text, _, error in parsed if error is None), batch_size, reparse)
+        for _, id, error in parsed:
+            record = {'error': error} if error else next(results)
+            if id is not None:
+                record = {'id': id, **record}
+            output.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        output.flush()
+        total += len(batch)
+    return total
+
+def user_input(reparse=False):
     try:
         while(text:=input("\nInsira frase: ")):
             # guardar valores de avaliação num dicionario com a frase, evidencias e score
-            avaliacao = analyze_sentiment_sentence(text)
+            avaliacao = analyze_sentiment_sentence(text, reparse)
             print("Word count:", avaliacao['num_palavras'])
             print("Sentiment Score:", avaliacao['score'])
+            if 'score_sentilex' in avaliacao:
+                print("Sentilex Score:", avaliacao['score_sentilex'])
+                print("LeIA Score:", avaliacao['score_leia'])
             # imprimir evidencias
-            print("Evidences:")
-            for key in avaliacao['evidencias']:
-                print("\t", key,":",avaliacao['evidencias'][key]) 
+            if 'evidencias' in avaliacao:
+                print("Evidences:")
+                for key in avaliacao['evidencias']:
+                    print("\t", key,":",list(avaliacao['evidencias'][key]))
     except KeyboardInterrupt:
         print("\nExiting... See you next time!")
     
-def frases_teste():
+def frases_teste(reparse=False):
     frases = """
 O café muito quente queimou-me a minha língua, mas eu gosto da sensação.
 Música alta sabe-me bem, mas os vizinhos queixam-se.
@@ -295,29 +1749,120 @@ O stress causado pelo trabalho é insuportável.
 """
     
     # separar frases por \n
-    frases = frases.split('\n')
-    for frase in frases:
-        if frase:
-            print(frase)
-            avaliacao = analyze_sentiment_sentence(frase)
-            print("Word count:", avaliacao['num_palavras'])
-            print("Sentiment Score:", avaliacao['score'])
-            # imprimir evidencias
+    frases = [frase for frase in frases.split('\n') if frase]
+    for frase, avaliacao in zip(frases, analyze_sentiments(frases, reparse=reparse)):
+        print(frase)
+        print("Word count:", avaliacao['num_palavras'])
+        print("Sentiment Score:", avaliacao['score'])
+        if 'score_sentilex' in avaliacao:
+            print("Sentilex Score:", avaliacao['score_sentilex'])
+            print("LeIA Score:", avaliacao['score_leia'])
+        # imprimir evidencias
+        if 'evidencias' in avaliacao:
             print("Evidences:")
             for key in avaliacao['evidencias']:
-                print("\t", key,":",avaliacao['evidencias'][key])
-            print("\n")
+                print("\t", key,":",list(avaliacao['evidencias'][key]))
+        print("\n")
     
+# escreve os agregados da instrumentação (<path>.json) e o cProfile (<path>.pstats)
+def write_profile(path, cprofile):
+    report = profiler.report()
+    with open(f'{path}.json', 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    cprofile.dump_stats(f'{path}.pstats')
+    print("\nProfile:")
+    for name, value in sorted(report['run'].items()):
+        print(f"\t{name}: {value:.4f}" if name.endswith('_seconds') else f"\t{name}: {value:.0f}")
+    print(f"Profile written to {path}.json and {path}.pstats")
+    pstats.Stats(cprofile).sort_stats('cumulative').print_stats(15)
+
 def main():
-    cl = clfilter("f:it", doc=__doc__)     ## option values in cl.opt dictionary
+    cl = clfilter("f:d:itm:o:", longopts=["reparse", "full-pipeline", "workers=", "build-snapshot", "cache=", "output-format=",
+                                                 "serve", "stream", "socket=", "host=", "port=", "max-batch=", "max-wait=", "profile=",
+                                                 "engine=", "build-lemma-table", "agreement=", "ensemble", "incremental", "score-only", "no-plot"], doc=__doc__)     ## option values in cl.opt dictionary
+    reparse = '--reparse' in cl.opt
+    model = cl.opt.get('-m', DEFAULT_MODEL)
+    exclude = [] if '--full-pipeline' in cl.opt else EXCLUDED_COMPONENTS
+    workers = int(cl.opt.get('--workers', 1))
+    cache_size = int(cl.opt.get('--cache', 0))
+    output_dir = cl.opt.get('-o', 'chapters')
+    output_format = cl.opt.get('--output-format', 'text')
+    if output_format not in OUTPUT_FORMATS:
+        die(f"Unknown output format '{output_format}' (choose from {', '.join(OUTPUT_FORMATS)})")
+    engine = cl.opt.get('--engine', DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        die(f"Unknown engine '{engine}' (choose from {', '.join(ENGINES)})")
+    # antes de arrancar os workers, que de outro modo falhariam um a um
+    if engine == 'fast' and '--build-lemma-table' not in cl.opt:
+        ensure_lemma_table(model, exclude)
+    profile = cl.opt.get('--profile')
+    init_args = (model, exclude, cache_size, bool(profile), engine, '--ensemble' in cl.opt, '--score-only' not in cl.opt)
+    if profile:
+        enable_profiling()
+        cprofile = cProfile.Profile()
+        cprofile.enable()
     
-    if '-f' in cl.opt:
-        init()
+    if '--build-snapshot' in cl.opt:
+        build_snapshot()
+        print(f"Lexicon snapshot written to {SNAPSHOT_PATH}")
+
+    elif '--build-lemma-table' in cl.opt:
+        init(model, exclude)
+        table = build_lemma_table((cl.opt['-f'],) if '-f' in cl.opt else ())
+        print(f"Lemma table with {len(table)} forms written to {LEMMA_TABLE_PATH}")
+
+    elif '--agreement' in cl.opt:
+        init(model, exclude)
+        init_fast(model, exclude)
+        engine_agreement(cl.opt['--agreement'])
+
+    elif '--serve' in cl.opt:
+        from . import server
+        init(*init_args)
+        host = cl.opt.get('--host', server.DEFAULT_HOST)
+        port = int(cl.opt.get('--port', server.DEFAULT_PORT))
+        max_batch = int(cl.opt.get('--max-batch', server.DEFAULT_MAX_BATCH))
+        max_wait = float(cl.opt.get('--max-wait', server.DEFAULT_MAX_WAIT * 1000)) / 1000
+        # pre-fork: o modelo carregado aqui é partilhado pelos workers
+        if workers > 1 or '--socket' in cl.opt:
+            server.run_prefork(workers, host, port, cl.opt.get('--socket'), max_batch, max_wait, reparse)
+        else:
+            server.run(host, port, max_batch, max_wait, reparse)
+
+    elif '--stream' in cl.opt:
+        # o stdout é só para os resultados; as mensagens vão para o stderr
+        output = sys.stdout.buffer
+        with redirect_stdout(sys.stderr):
+            init(*init_args)
+            try:
+                total = stream_sentiments(sys.stdin.buffer, output,
+                                          int(cl.opt.get('--max-batch', DEFAULT_BATCH_SIZE)), reparse)
+                print(f"{total} lines analysed")
+            except BrokenPipeError:
+                # o leitor fechou o pipe (p.ex. head): terminar sem erro
+                os.dup2(os.open(os.devnull, os.O_WRONLY), output.fileno())
+
+    elif '-d' in cl.opt:
+        if workers <= 1:
+            init(*init_args)
+        try:
+            summary = analyze_corpus(cl.opt['-d'], reparse, workers, init_args, cl.opt.get('-o', 'corpus'))
+        except FileNotFoundError as e:
+            die(str(e))
+        print(f"\nCorpus: {summary['files']} files, {summary['sentences']} sentences, "
+              f"score {summary['score']} ({len(summary['errors'])} errors)")
+
+    elif '-f' in cl.opt:
+        # com vários workers o modelo só é carregado nos workers
+        if workers <= 1:
+            init(*init_args)
         file_path = cl.opt['-f']
         if file_path.endswith('.txt'):
             if os.path.exists(file_path):
                 # analisar sentimento do livro
-                book_score = analyze_sentiment_book(file_path)
+                book_score = analyze_sentiment_book(file_path, reparse, workers, init_args, output_dir, output_format,
+                                                    plot='--no-plot' not in cl.opt,
+                                                    incremental='--incremental' in cl.opt)
                 print(f"\nBook Score: {book_score}")
             else:
                 print("File not found.")
@@ -325,13 +1870,20 @@ def main():
             print("File not supported.")
         
     elif '-t' in cl.opt:
-        init()
-        frases_teste()
+        init(*init_args)
+        frases_teste(reparse)
         
     else:
         # default: user input mode
-        init()
-        user_input()
+        init(*init_args)
+        user_input(reparse)
+    
+    with redirect_stdout(sys.stderr) if '--stream' in cl.opt else nullcontext():
+        if sentence_cache is not None:
+            print(f"Sentence cache: {sentence_cache.info()}")
+        if profile:
+            cprofile.disable()
+            write_profile(profile, cprofile)
     
 if __name__ == '__main__':
     main()
@@ -0,0 +1,215 @@
+"""
+    NAME
+        sentiment_analysis.benchmark
+
+    DESCRIPTION
+        Reproducible benchmark of the sentiment analyzer. Measures the init()
+        cold start (in a fresh interpreter), the throughput (sentences/s) of
+        analyze_sentiment_sentence, analyze_sentiments and analyze_sentiment_book,
+        the throughput of the fast engine (no spaCy model), the throughput of LeIA's SentimentIntensityAnalyzer.polarity_scores,
+        and the peak memory (RSS and tracemalloc). The corpus is HP.txt or a
+        synthetic corpus of a given number of sentences, sampled from HP.txt
+        with a fixed seed. Results are written to a JSON file and can be
+        compared against a stored baseline.
+
+    OPTIONS
+        -o <file>       :   Results file (default: benchmark.json).
+        -b <file>       :   Baseline results to compare against.
+        -n <sentences>  :   Size of the synthetic corpus (default: the whole of HP.txt).
+        -m <model>      :   spaCy model: sm, md, lg (default) or a full model name.
+        -r <repeat>     :   Repetitions of each measurement; the best is kept (default: 3).
+        --seed <n>      :   Seed of the synthetic corpus (default: 0).
+        --threshold <p> :   Regression threshold in percent (default: 10).
+
+    EXAMPLES
+        python -m sentiment_analysis.benchmark
+        python -m sentiment_analysis.benchmark -n 50000 -o new.json -b baseline.json
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import spacy
+from jjcli import clfilter
+
+import sentiment_analysis as sa
+
+BOOK_PATH = 'HP.txt'
+# frases por capítulo do corpus sintético
+SYNTHETIC_CHAPTER_SIZE = 500
+# frases usadas na medição com tracemalloc (muito mais lenta)
+TRACEMALLOC_SAMPLE = 1000
+
+# métricas e sentido em que são melhores
+HIGHER_IS_BETTER = {
+    'init_cold_seconds': False,
+    'init_warm_seconds': False,
+    'sentence_per_second': True,
+    'batch_per_second': True,
+    'book_per_second': True,
+    'fast_per_second': True,
+    'leia_per_second': True,
+    'peak_rss_mb': False,
+    'tracemalloc_peak_mb': False,
+}
+
+def book_sentences(path=BOOK_PATH):
+    return [sentence for _, sentences in sa.iter_chapters(path) for sentence in sentences]
+
+# corpus sintético: n frases tiradas do livro com uma seed fixa
+def synthetic_sentences(n, seed=0):
+    sentences = book_sentences()
+    rng = random.Random(seed)
+    return [rng.choice(sentences) for _ in range(n)]
+
+def write_book(sentences, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        for i in range(0, len(sentences), SYNTHETIC_CHAPTER_SIZE):
+            file.write(f"# {i // SYNTHETIC_CHAPTER_SIZE + 1}\n")
+            file.write('\n'.join(sentences[i:i + SYNTHETIC_CHAPTER_SIZE]) + '\n')
+
+# melhor tempo de repeat execuções de func
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+# arranque a frio: um interpretador novo que importa o pacote e chama init()
+def bench_init_cold(model, repeat):
+    code = ("import time; start = time.perf_counter(); import sentiment_analysis as sa; "
+            f"sa.init({model!r}); print(time.perf_counter() - start)")
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+def bench_sentences(sentences, repeat):
+    def run():
+        for sentence in sentences:
+            sa.analyze_sentiment_sentence(sentence)
+    return len(sentences) / best_time(run, repeat)
+
+def bench_batch(sentences, repeat):
+    return len(sentences) / best_time(lambda: list(sa.analyze_sentiments(sentences)), repeat)
+
+def bench_book(sentences, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        book_path = os.path.join(tmp, 'book.txt')
+        write_book(sentences, book_path)
+        output_dir = os.path.join(tmp, 'chapters')
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                sa.analyze_sentiment_book(book_path, output_dir=output_dir, plot=False)
+        return len(sentences) / best_time(run, repeat)
+
+def bench_fast(model, sentences, repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sa.init(model, engine='fast')
+    return len(sentences) / best_time(lambda: list(sa.analyze_sentiments(sentences)), repeat)
+
+def bench_leia(sentences, repeat):
+    analyzer = sa.load_leia().SentimentIntensityAnalyzer()
+    def run():
+        for sentence in sentences:
+            analyzer.polarity_scores(sentence)
+    return len(sentences) / best_time(run, repeat)
+
+def bench_tracemalloc(sentences):
+    tracemalloc.start()
+    list(sa.analyze_sentiments(sentences[:TRACEMALLOC_SAMPLE]))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB em Linux, bytes em macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def run_benchmark(model=sa.DEFAULT_MODEL, n=None, seed=0, repeat=3):
+    sentences = synthetic_sentences(n, seed) if n else book_sentences()
+    metrics = {}
+    print("Measuring init() cold start...")
+    metrics['init_cold_seconds'] = bench_init_cold(model, repeat)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sa.init(model)
+    metrics['init_warm_seconds'] = time.perf_counter() - start
+    print(f"Measuring throughput over {len(sentences)} sentences...")
+    metrics['sentence_per_second'] = bench_sentences(sentences, repeat)
+    metrics['batch_per_second'] = bench_batch(sentences, repeat)
+    metrics['book_per_second'] = bench_book(sentences, repeat)
+    metrics['leia_per_second'] = bench_leia(sentences, repeat)
+    metrics['tracemalloc_peak_mb'] = bench_tracemalloc(sentences)
+    # por último: init(engine='fast') deixa o motor rápido ativo
+    if os.path.isfile(sa.LEMMA_TABLE_PATH):
+        metrics['fast_per_second'] = bench_fast(model, sentences, repeat)
+    else:
+        print(f"Skipping the fast engine: {sa.LEMMA_TABLE_PATH} not found (sentiment-analysis --build-lemma-table).")
+    metrics['peak_rss_mb'] = peak_rss()
+    meta = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'spacy': spacy.__version__,
+        'model': sa.nlp.meta.get('name', model),
+        'model_version': sa.nlp.meta.get('version'),
+        'pipeline': sa.nlp.pipe_names,
+        'corpus': f"synthetic:{n}:seed={seed}" if n else BOOK_PATH,
+        'sentences': len(sentences),
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'metrics': metrics}
+
+# devolve as métricas que pioraram mais do que threshold (%) face à baseline
+def compare(baseline, results, threshold=10):
+    regressions = []
+    print(f"\n{'metric':<22}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, higher_is_better in HIGHER_IS_BETTER.items():
+        old = baseline['metrics'].get(name)
+        new = results['metrics'].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{name:<22}{old:>12.3f}{new:>12.3f}{change:>+8.1f}%{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    cl = clfilter("o:b:n:m:r:", longopts=["seed=", "threshold="], doc=__doc__)
+    results = run_benchmark(cl.opt.get('-m', sa.DEFAULT_MODEL),
+                            int(cl.opt['-n']) if '-n' in cl.opt else None,
+                            int(cl.opt.get('--seed', 0)),
+                            int(cl.opt.get('-r', 3)))
+    output = cl.opt.get('-o', 'benchmark.json')
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    for name, value in results['metrics'].items():
+        print(f"{name:<22}{value:>12.3f}")
+    print(f"Results written to {output}")
+    if '-b' in cl.opt:
+        with open(cl.opt['-b']) as file:
+            baseline = json.load(file)
+        if compare(baseline, results, float(cl.opt.get('--threshold', 10))):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+    NAME
+        sentiment_analysis.server
+
+    DESCRIPTION
+        Asyncio HTTP/JSON scoring service. The model is loaded once (init) and
+        the sentences of concurrent requests are grouped into micro-batches
+        (up to max_batch sentences, waiting at most max_wait seconds for the
+        batch to fill) before they reach spaCy.
+
+    ENDPOINTS
+        POST /analyze   {"text": "..."}          -> avaliacao
+        POST /analyze   {"texts": ["...", ...]}  -> {"results": [avaliacao, ...]}
+        GET  /health                             -> {"status": "ok", "pid", "memory", ...}
+
+    PRE-FORK
+        With run_prefork, the parent process (where init already loaded the
+        model) binds the socket, freezes the garbage collector and forks the
+        workers, which share the model's memory pages copy-on-write and
+        accept connections on the same socket (a Unix socket, or TCP). Dead
+        workers are replaced. The private memory of each worker (the pages
+        it does not share) is reported on SIGUSR1, at shutdown and by
+        GET /health.
+"""
+
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+import stat
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import DEFAULT_BATCH_SIZE, analyze_sentiments
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT = 0.005
+# tamanho máximo do corpo de um pedido (bytes)
+MAX_BODY_SIZE = 2**24
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# um worker que morre antes disto não é substituído (erro no arranque)
+WORKER_MIN_LIFETIME = 1.0
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Junta as frases de pedidos concorrentes em lotes. O nlp não é partilhado
+# entre threads, por isso os lotes são analisados um de cada vez numa única
+# thread, enquanto o event loop continua a aceitar pedidos.
+class MicroBatcher:
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, reparse=False):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.reparse = reparse
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = self.sentences = 0
+
+    async def analyze(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            texts = [text for text, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.analyze_batch, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.sentences += len(batch)
+            for (_, future), avaliacao in zip(batch, results):
+                if not future.done():
+                    future.set_result(avaliacao)
+
+    def analyze_batch(self, texts):
+        batch_size = min(len(texts), DEFAULT_BATCH_SIZE)
+        return list(analyze_sentiments(texts, batch_size=batch_size, reparse=self.reparse))
+
+async def handle_request(batcher, method, path, body):
+    if path == '/health':
+        return {'status': 'ok', 'pid': os.getpid(), 'batches': batcher.batches,
+                'sentences': batcher.sentences, 'memory': process_memory()}
+    if path != '/analyze':
+        raise HTTPError(404, f"Unknown path {path}")
+    if method != 'POST':
+        raise HTTPError(405, "Use POST /analyze")
+    try:
+        request = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "Invalid JSON body")
+    if isinstance(request, dict) and isinstance(request.get('text'), str):
+        return await batcher.analyze(request['text'])
+    if isinstance(request, dict) and isinstance(request.get('texts'), list) \
+            and all(isinstance(text, str) for text in request['texts']):
+        results = await asyncio.gather(*(batcher.analyze(text) for text in request['texts']))
+        return {'results': results}
+    raise HTTPError(400, 'Expected {"text": "..."} or {"texts": ["...", ...]}')
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+    return method, path.split('?')[0], body, keep_alive
+
+def write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+async def handle_connection(batcher, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                status, payload = 200, await handle_request(batcher, method, path, body)
+            except HTTPError as e:
+                status, payload, keep_alive = e.status, {'error': str(e)}, False
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                status, payload, keep_alive = 500, {'error': f"{type(e).__name__}: {e}"}, False
+            write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+# com sock, serve num socket já aberto (o dos workers do pre-fork)
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH,
+                max_wait=DEFAULT_MAX_WAIT, reparse=False, sock=None):
+    batcher = MicroBatcher(max_batch, max_wait, reparse)
+    batch_task = asyncio.create_task(batcher.run())
+    handler = lambda reader, writer: handle_connection(batcher, reader, writer)
+    if sock is None:
+        server = await asyncio.start_server(handler, host, port)
+        print(f"Serving on http://{host}:{port} (max batch {max_batch}, max wait {max_wait * 1000:g} ms)")
+    elif sock.family == socket.AF_UNIX:
+        server = await asyncio.start_unix_server(handler, sock=sock)
+    else:
+        server = await asyncio.start_server(handler, sock=sock)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+# ponto de entrada do modo --serve (o modelo já foi carregado por init)
+def run(host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH,
+        max_wait=DEFAULT_MAX_WAIT, reparse=False):
+    try:
+        asyncio.run(serve(host, port, max_batch, max_wait, reparse))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+
+# memória do processo (MB) segundo /proc/<pid>/smaps_rollup: private são as
+# páginas só deste processo, shared as partilhadas (p.ex. o modelo, com o pai
+# e os outros workers), e pss a parte proporcional das partilhadas
+def process_memory(pid='self'):
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps:
+            for line in smaps:
+                name, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        return None
+    return {'rss_mb': fields.get('Rss', 0), 'pss_mb': fields.get('Pss', 0),
+            'private_mb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+            'shared_mb': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)}
+
+# lê a memória de todos os processos; pode ser mostrada depois (à saída, os
+# workers já terminaram quando o relatório é escrito)
+def read_memory(workers):
+    return [(name, process_memory(pid)) for name, pid in
+            [('parent', os.getpid())] + [(f'worker {pid}', pid) for pid in workers]]
+
+def report_memory(workers=None, readings=None):
+    print(f"\n{'process':<16}{'rss':>10}{'pss':>10}{'private':>10}{'shared':>10}  (MB)")
+    for name, memory in readings or read_memory(workers):
+        if memory is None:
+            print(f"{name:<16}{'(no /proc/<pid>/smaps_rollup)':>40}")
+            continue
+        print(f"{name:<16}{memory['rss_mb']:>10.1f}{memory['pss_mb']:>10.1f}"
+              f"{memory['private_mb']:>10.1f}{memory['shared_mb']:>10.1f}")
+
+def listen_socket(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    if socket_path is None:
+        sock = socket.create_server((host, port))
+    else:
+        # remover um socket que tenha ficado de uma execução anterior
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.listen()
+    return sock
+
+def fork_worker(sock, max_batch, max_wait, reparse):
+    pid = os.fork()
+    if pid:
+        return pid
+    # worker: o Ctrl+C chega a todo o grupo de processos, mas quem o trata é o pai
+    code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        asyncio.run(serve(max_batch=max_batch, max_wait=max_wait, reparse=reparse, sock=sock))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+class Shutdown(Exception):
+    pass
+
+def stop(signum, frame):
+    raise Shutdown()
+
+# ponto de entrada do modo --serve --workers/--socket: o modelo já foi
+# carregado por init, neste processo, antes de qualquer fork
+def run_prefork(workers=2, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None,
+                max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, reparse=False):
+    sock = listen_socket(host, port, socket_path)
+    # tudo o que já existe fica fora das recolhas do gc, que de outro modo
+    # escreveriam nas páginas partilhadas e as copiariam para cada worker
+    gc.collect()
+    gc.freeze()
+    children = {}
+    def spawn():
+        children[fork_worker(sock, max_batch, max_wait, reparse)] = time.monotonic()
+    for _ in range(workers):
+        spawn()
+    address = f"unix:{socket_path}" if socket_path else f"http://{host}:{port}"
+    print(f"Serving on {address} with {workers} workers (max batch {max_batch}, "
+          f"max wait {max_wait * 1000:g} ms); kill -USR1 {os.getpid()} reports their memory")
+    signal.signal(signal.SIGUSR1, lambda signum, frame: report_memory(children))
+    # o SIGINT também é tratado aqui: lançado em segundo plano, o processo
+    # herda-o ignorado e o Python não o converte em KeyboardInterrupt
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while children:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            print(f"Worker {pid} exited with status {code}")
+            if time.monotonic() - started >= WORKER_MIN_LIFETIME:
+                spawn()
+    except (KeyboardInterrupt, Shutdown):
+        pass
+    finally:
+        # um segundo sinal (outro Ctrl+C, ou um sinal para todo o grupo, como
+        # o do timeout) não pode interromper a paragem dos workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        readings = read_memory(children) if children else None
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sock.close()
+        if socket_path:
+            try:
+                os.unlink(socket_path)
+            except FileNotFoundError:
+                pass
+        if readings:
+            report_memory(readings=readings)
+        print("\nServer stopped.")
@@ -0,0 +1,96 @@
+''' Equivalência do tokenizador do LeIA
+
+O SentiText separa as palavras numa só passagem (strip_punc). Este teste
+compara-o com a implementação original do VADER, com as tabelas de produto
+palavra × pontuação, sobre o vocabulário dos léxicos do LeIA (cada entrada
+rodeada por todos os sinais de pontuação) e sobre as linhas de HP.txt.
+
+'''
+
+import importlib.util
+import os
+import unicodedata
+from itertools import product
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEIA_PATH = os.path.join(ROOT, 'data', 'datasets', 'LeIA', 'leia.py')
+BOOK_PATH = os.path.join(ROOT, 'HP.txt')
+
+
+def load_leia():
+    spec = importlib.util.spec_from_file_location('leia', LEIA_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+leia = load_leia()
+
+
+# implementação original: SentiText._words_plus_punc e _words_and_emoticons
+def words_plus_punc(text):
+    no_punc_text = leia.REGEX_REMOVE_PUNCTUATION.sub('', text)
+    words_only = set(w for w in no_punc_text.split() if len(w) > 1)
+    punc_before = {''.join(p): p[1] for p in product(leia.PUNC_LIST, words_only)}
+    punc_after = {''.join(p): p[0] for p in product(words_only, leia.PUNC_LIST)}
+    words_punc_dict = punc_before
+    words_punc_dict.update(punc_after)
+    return words_punc_dict
+
+
+def words_and_emoticons_product(text):
+    words_punc_dict = words_plus_punc(text)
+    wes = [we for we in text.split() if len(we) > 1]
+    for i, we in enumerate(wes):
+        if we in words_punc_dict:
+            wes[i] = words_punc_dict[we]
+    return wes
+
+
+def lexicon_texts():
+    texts = []
+    for path in (leia.NEGATE_FILE, leia.BOOSTER_FILE, leia.LEXICON_FILE, leia.EMOJI_LEXICON_FILE):
+        with open(path, encoding='utf-8') as f:
+            vocabulary = [line.split('\t')[0].strip() for line in f if line.strip()]
+        for word in vocabulary:
+            texts.append(word)
+            texts.append(' '.join(p + word for p in leia.PUNC_LIST))
+            texts.append(' '.join(word + p for p in leia.PUNC_LIST))
+            texts.append(' '.join(p + word.upper() + p for p in leia.PUNC_LIST) + ' ' + word)
+    return texts
+
+
+def book_texts():
+    texts = []
+    with open(BOOK_PATH, encoding='utf-8') as f:
+        for line in f:
+            texts.append(line)
+            texts.append(unicodedata.normalize('NFKD', line).encode('ASCII', 'ignore').decode('ASCII'))
+    return texts
+
+
+def mismatches(texts):
+    found = []
+    for text in texts:
+        sentitext = leia.SentiText(text)
+        words = words_and_emoticons_product(text)
+        if sentitext.words_and_emoticons != words or \
+                sentitext.is_cap_diff != leia.allcap_differential(words):
+            found.append(text)
+    return found
+
+
+def test_lexicon_vocabulary():
+    assert mismatches(lexicon_texts())[:10] == []
+
+
+@pytest.mark.skipif(not os.path.isfile(BOOK_PATH), reason='HP.txt not found')
+def test_book():
+    assert mismatches(book_texts())[:10] == []
+
+
+def test_words_given_by_caller():
+    text = 'Não, eu NÃO gostei... :) !!! - ok?!'
+    assert leia.SentiText(text, text.split()).words_and_emoticons == words_and_emoticons_product(text)